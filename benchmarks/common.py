@@ -0,0 +1,60 @@
+"""Helpers shared by the benchmarks."""
+
+import os
+import json
+import time
+import asyncio
+import statistics
+
+from bot.constants import AUDIO_FILE_EXTENSIONS
+
+
+async def run(cmd: list) -> str:
+    """Runs command, returns its stdout"""
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+    stdout, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(f"{cmd!r} exited with {proc.returncode}:\n{stderr.decode()}")
+    return stdout.decode()
+
+
+async def timed(cmd: list) -> tuple:
+    """Runs command, returns (wall clock seconds, stdout)"""
+    started = time.perf_counter()
+    stdout = await run(cmd)
+    return time.perf_counter() - started, stdout
+
+
+def match_result(stdout: str):
+    """Returns matched track name from fingerprinter output, None if nothing matched"""
+    result = None
+    for line in stdout.splitlines():
+        try:
+            result = json.loads(line)["RESULT"]
+        except Exception:
+            pass
+    if result is None or result == "NOMATCH":
+        return None
+    return os.path.splitext(os.path.basename(result))[0]
+
+
+def audio_files(directory) -> list:
+    return sorted(
+        os.path.join(directory, file_name) for file_name in os.listdir(directory)
+        if os.path.splitext(file_name)[1].lower() in AUDIO_FILE_EXTENSIONS
+    )
+
+
+def summary(values: list) -> dict:
+    """Returns latency distribution in seconds"""
+    if not values:
+        return {}
+    values = sorted(values)
+    return {
+        "count": len(values),
+        "mean": statistics.fmean(values),
+        "p50": values[int(0.50 * (len(values) - 1))],
+        "p95": values[int(0.95 * (len(values) - 1))],
+        "p99": values[int(0.99 * (len(values) - 1))],
+        "max": values[-1],
+    }
@@ -0,0 +1,121 @@
+"""
+Compact postings of a fingerprint index.
+
+Postings of every hash are (track, time) pairs packed into one integer
+`track << time_bits | time`, sorted, delta-encoded and written as LEB128
+varints into one byte stream. Hashes are kept in a sorted array with byte
+offsets of their postings, so lookup of the query hashes is a binary search,
+number of postings is the number of varints in the byte range.
+Encoding and decoding are vectorized with numpy, a query decodes postings of
+all its hashes at once.
+
+This is a size study for `benchmarks.postings`, the index format of the
+backends is not changed: audfprint keeps its own hash table. numpy is
+installed together with audfprint.
+"""
+
+import numpy as np
+
+
+def encode_varints(values: np.ndarray) -> np.ndarray:
+    """Unsigned integers to LEB128 bytes"""
+    values = values.astype(np.uint64)
+    lengths = np.ones(len(values), dtype=np.int64)
+    for num in range(1, 10):
+        lengths += values >= np.uint64(1 << (7 * num))
+
+    starts = np.cumsum(lengths) - lengths
+    data = np.empty(int(lengths.sum()), dtype=np.uint8)
+    for num in range(int(lengths.max(initial=0))):
+        selected = lengths > num
+        chunk = (values[selected] >> np.uint64(7 * num)) & np.uint64(0x7F)
+        continuation = np.where(lengths[selected] > num + 1, 0x80, 0).astype(np.uint64)
+        data[starts[selected] + num] = chunk | continuation
+    return data
+
+
+def decode_varints(data: np.ndarray) -> np.ndarray:
+    """LEB128 bytes to unsigned integers"""
+    if not len(data):
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    positions = np.arange(len(data)) - np.repeat(starts, ends - starts + 1)
+    parts = (data & 0x7F).astype(np.uint64) << (7 * positions).astype(np.uint64)
+    return np.bitwise_or.reduceat(parts, starts)
+
+
+def _ranges(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Concatenated aranges of [start, end) pairs"""
+    lengths = ends - starts
+    offsets = np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+    return offsets + np.arange(int(lengths.sum()))
+
+
+class Postings:
+    def __init__(self, hashes: np.ndarray, offsets: np.ndarray, data: np.ndarray, time_bits: int):
+        self.hashes = hashes
+        self.offsets = offsets
+        self.data = data
+        self.time_bits = time_bits
+
+    @classmethod
+    def from_arrays(cls, hashes, tracks, times, time_bits: int) -> "Postings":
+        """Builds postings from parallel arrays of (hash, track, time)"""
+        hashes = np.asarray(hashes, dtype=np.uint32)
+        values = (np.asarray(tracks, dtype=np.uint64) << np.uint64(time_bits)) | np.asarray(times, dtype=np.uint64)
+        order = np.lexsort((values, hashes))
+        hashes, values = hashes[order], values[order]
+
+        unique_hashes, group_starts, counts = np.unique(hashes, return_index=True, return_counts=True)
+        # First posting of every hash is stored as is, the rest as differences
+        deltas = np.diff(values, prepend=np.uint64(0))
+        deltas[group_starts] = values[group_starts]
+
+        data = encode_varints(deltas)
+        value_ends = np.flatnonzero(data < 0x80) + 1
+        offsets = np.concatenate(([0], value_ends[group_starts + counts - 1])).astype(np.uint32 if len(data) < 2 ** 32 else np.uint64)
+        return cls(unique_hashes, offsets, data, time_bits)
+
+    def lookup(self, query_hashes) -> tuple:
+        """
+        Returns (query hash index, track, time) arrays of all postings of the
+        query hashes, hashes missing in the index are skipped.
+        """
+        query_hashes = np.asarray(query_hashes, dtype=np.uint32)
+        positions = np.minimum(np.searchsorted(self.hashes, query_hashes), max(len(self.hashes) - 1, 0))
+        found = np.flatnonzero(self.hashes[positions] == query_hashes) if len(self.hashes) else np.zeros(0, dtype=np.int64)
+        positions = positions[found]
+        if not len(positions):
+            return found, np.zeros(0, dtype=np.uint32), np.zeros(0, dtype=np.uint32)
+
+        starts = self.offsets[positions].astype(np.int64)
+        ends = self.offsets[positions + 1].astype(np.int64)
+        chunk = self.data[_ranges(starts, ends)]
+        deltas = decode_varints(chunk)
+        counts = np.diff(np.cumsum(chunk < 0x80)[np.cumsum(ends - starts) - 1], prepend=0)
+
+        # Undo delta encoding: running sum restarted at the first posting of every hash
+        sums = np.cumsum(deltas)
+        group_ends = np.cumsum(counts)
+        before_group = np.concatenate(([0], sums[group_ends[:-1] - 1])).astype(np.uint64)
+        values = sums - np.repeat(before_group, counts)
+
+        time_mask = np.uint64((1 << self.time_bits) - 1)
+        return np.repeat(found, counts), (values >> np.uint64(self.time_bits)).astype(np.uint32), (values & time_mask).astype(np.uint32)
+
+    @property
+    def postings_count(self) -> int:
+        return int(np.count_nonzero(self.data < 0x80))
+
+    @property
+    def nbytes(self) -> int:
+        return self.hashes.nbytes + self.offsets.nbytes + self.data.nbytes
+
+    def save(self, file_path) -> None:
+        np.savez(file_path, hashes=self.hashes, offsets=self.offsets, data=self.data, time_bits=self.time_bits)
+
+    @classmethod
+    def load(cls, file_path) -> "Postings":
+        with np.load(file_path) as arrays:
+            return cls(arrays["hashes"], arrays["offsets"], arrays["data"], int(arrays["time_bits"]))
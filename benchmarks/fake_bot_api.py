@@ -0,0 +1,147 @@
+"""
+Local stand-in of the Telegram Bot API for load tests.
+
+Serves only what the bot uses: getMe, getUpdates, getFile, file downloads,
+sendMessage, editMessageText, deleteMessage and answerCallbackQuery.
+Simulated users put updates into the queue and wait for bot calls addressed
+to their chat.
+"""
+
+import json
+import time
+import asyncio
+import itertools
+
+from aiohttp import web
+
+
+class FakeBotAPI:
+    def __init__(self, token, files: dict):
+        """files - file_id -> path of the file served for it"""
+        self.token = token
+        self.files = files
+        self.updates = []
+        self.new_updates = asyncio.Event()
+        self.chat_calls = {}
+        self.calls_count = {}
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._callback_ids = itertools.count(1)
+
+        self.app = web.Application()
+        self.app.router.add_route("*", "/bot{token}/{method}", self.handle_method)
+        self.app.router.add_get("/file/bot{token}/{file_path:.+}", self.handle_file)
+        self._runner = None
+
+    async def start(self, host="127.0.0.1", port=8081):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    # Bot side
+
+    async def handle_method(self, request):
+        if request.match_info["token"] != self.token:
+            return web.json_response({"ok": False, "error_code": 401, "description": "Unauthorized"}, status=401)
+
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        if request.query:
+            params.update(request.query)
+        self.calls_count[method] = self.calls_count.get(method, 0) + 1
+
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            return web.json_response({"ok": True, "result": True})
+        return web.json_response({"ok": True, "result": await handler(params)})
+
+    async def handle_file(self, request):
+        file_path = self.files.get(request.match_info["file_path"])
+        if file_path is None:
+            raise web.HTTPNotFound()
+        return web.FileResponse(file_path)
+
+    async def api_getMe(self, params):
+        return {"id": 1, "is_bot": True, "first_name": "StravinskyBot", "username": "stravinsky_loadtest_bot"}
+
+    async def api_getUpdates(self, params):
+        offset = int(params.get("offset") or 0)
+        self.updates = [x for x in self.updates if x["update_id"] >= offset]
+        if not self.updates:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self.updates[:int(params.get("limit") or 100)]
+
+    async def api_getFile(self, params):
+        return {"file_id": params["file_id"], "file_unique_id": params["file_id"], "file_path": params["file_id"]}
+
+    async def api_sendMessage(self, params):
+        message = self._message(int(params["chat_id"]), next(self._message_ids), params.get("text", ""), params.get("reply_markup"), from_bot=True)
+        self._record(message["chat"]["id"], "sendMessage", message)
+        return message
+
+    async def api_editMessageText(self, params):
+        message = self._message(int(params["chat_id"]), int(params["message_id"]), params.get("text", ""), params.get("reply_markup"), from_bot=True)
+        self._record(message["chat"]["id"], "editMessageText", message)
+        return message
+
+    def _record(self, chat_id, method, message):
+        self.chat_calls.setdefault(chat_id, asyncio.Queue()).put_nowait((time.perf_counter(), method, message))
+
+    # User side
+
+    def _message(self, chat_id, message_id, text=None, reply_markup=None, from_bot=False, **content) -> dict:
+        message = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": f"Student {chat_id}"},
+            "from": {"id": 1 if from_bot else chat_id, "is_bot": from_bot, "first_name": "StravinskyBot" if from_bot else f"Student {chat_id}"},
+            **content,
+        }
+        if text is not None:
+            message["text"] = text
+        if reply_markup:
+            message["reply_markup"] = json.loads(reply_markup) if isinstance(reply_markup, str) else reply_markup
+        return message
+
+    def _put_update(self, **update) -> float:
+        self.updates.append({"update_id": next(self._update_ids), **update})
+        self.new_updates.set()
+        return time.perf_counter()
+
+    def send_text(self, chat_id, text) -> float:
+        return self._put_update(message=self._message(chat_id, next(self._message_ids), text))
+
+    def send_document(self, chat_id, file_id, file_name) -> float:
+        document = {"file_id": file_id, "file_unique_id": f"{file_id}:{chat_id}:{next(self._message_ids)}", "file_name": file_name, "file_size": 1}
+        return self._put_update(message=self._message(chat_id, next(self._message_ids), document=document))
+
+    def send_voice(self, chat_id, file_id) -> float:
+        voice = {"file_id": file_id, "file_unique_id": f"{file_id}:{chat_id}:{next(self._message_ids)}", "duration": 5, "mime_type": "audio/ogg", "file_size": 1}
+        return self._put_update(message=self._message(chat_id, next(self._message_ids), voice=voice))
+
+    def press_button(self, chat_id, message: dict, data) -> float:
+        callback_query = {
+            "id": str(next(self._callback_ids)),
+            "from": {"id": chat_id, "is_bot": False, "first_name": f"Student {chat_id}"},
+            "chat_instance": str(chat_id),
+            "message": message,
+            "data": data,
+        }
+        return self._put_update(callback_query=callback_query)
+
+    async def wait_for(self, chat_id, predicate, timeout) -> tuple:
+        """Waits for bot call to the chat matching predicate(method, message), returns (time, method, message)"""
+        calls = self.chat_calls.setdefault(chat_id, asyncio.Queue())
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            called_at, method, message = await asyncio.wait_for(calls.get(), deadline - loop.time())
+            if predicate(method, message):
+                return called_at, method, message
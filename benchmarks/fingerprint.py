@@ -0,0 +1,173 @@
+"""
+Micro-benchmark of the recognition stage alone.
+
+Generates a reproducible synthetic corpus (procedural melodies rendered by
+ffmpeg), builds fingerprint databases of several sizes for every backend and
+AUDFPRINT_MODE, then measures ingest throughput, index load time, per-query
+match latency and recall of clean and distorted (noise, pitch, tempo)
+excerpts. Results are written as JSON, so that runs can be compared.
+
+Index load time is measured as match time of one second of silence, which
+is dominated by loading the database.
+
+Usage:
+    python -m benchmarks.fingerprint --sizes 10 90 1000 --queries 20 -o fingerprint.json
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+
+from loguru import logger
+
+from bot.constants import AudioLibrariesEnum, AudfprintModeEnum
+from bot.fingerprint import add_hashes_cmds, match_cmd, AUDFPRINT_PATH, SOUNDFINGERPRINTING_PATH
+from benchmarks.common import run, timed, match_result, summary
+
+SAMPLE_RATE = 22050
+EXCERPT_DURATION = 10
+
+# (AUDIO_LIBRARY, AUDFPRINT_MODE)
+BACKENDS = {
+    "audfprint-accurate": (AudioLibrariesEnum.audfprint.value, AudfprintModeEnum.accurate.value),
+    "audfprint-fast": (AudioLibrariesEnum.audfprint.value, AudfprintModeEnum.fast.value),
+    "SoundFingerprinting": (AudioLibrariesEnum.SoundFingerprinting.value, None),
+}
+BACKEND_PATHS = {
+    AudioLibrariesEnum.audfprint.value: AUDFPRINT_PATH,
+    AudioLibrariesEnum.SoundFingerprinting.value: SOUNDFINGERPRINTING_PATH,
+}
+
+DISTORTIONS = {
+    "clean": None,
+    "noise": "[0:a]anull[a];anoisesrc=amplitude=0.1:color=pink:sample_rate={rate}:duration={duration}[n];[a][n]amix=inputs=2:duration=first",
+    "pitch": "[0:a]asetrate={rate}*1.03,aresample={rate},atempo=0.970874",
+    "tempo": "[0:a]atempo=1.05",
+}
+
+
+def melody_expression(rng: random.Random, duration: float) -> str:
+    """ffmpeg aevalsrc expression of random melody: decaying notes with harmonics over a slow bass line"""
+    terms = []
+    t = 0.0
+    while t < duration:
+        note_length = rng.choice((0.25, 0.5, 0.5, 0.75, 1.0))
+        frequency = 220 * 2 ** (rng.randint(-12, 19) / 12)
+        terms.append(
+            f"between(t,{t:.2f},{t + note_length:.2f})*exp(-3*(t-{t:.2f}))"
+            f"*(sin(2*PI*{frequency:.2f}*t)+0.5*sin(4*PI*{frequency:.2f}*t)+0.25*sin(6*PI*{frequency:.2f}*t))"
+        )
+        t += note_length
+    bass = 55 * 2 ** (rng.randint(0, 11) / 12)
+    return f"0.3*({'+'.join(terms)})+0.2*sin(2*PI*{bass:.2f}*t)*(1+0.5*sin(2*PI*0.25*t))"
+
+
+async def generate_corpus(directory, size, duration, seed) -> list:
+    """Renders `size` synthetic tracks, already rendered tracks are reused"""
+    os.makedirs(directory, exist_ok=True)
+    semaphore = asyncio.Semaphore(os.cpu_count() or 1)
+
+    async def render(num):
+        track = os.path.join(directory, f"track_{seed}_{duration}_{num:05d}.mp3")
+        if not os.path.exists(track):
+            expression = melody_expression(random.Random(f"{seed}:{num}"), duration)
+            async with semaphore:
+                await run(["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", f"aevalsrc='{expression}':s={SAMPLE_RATE}:d={duration}", "-ac", "1", "-c:a", "libmp3lame", track])
+        return track
+
+    return await asyncio.gather(*map(render, range(size)))
+
+
+async def make_query(track, offset, distortion, output):
+    cmd = ["ffmpeg", "-y", "-v", "error", "-ss", str(offset), "-t", str(EXCERPT_DURATION), "-i", track]
+    if DISTORTIONS[distortion]:
+        cmd += ["-filter_complex", DISTORTIONS[distortion].format(rate=SAMPLE_RATE, duration=EXCERPT_DURATION)]
+    await run(cmd + ["-ac", "1", "-c:a", "libmp3lame", output])
+
+
+async def benchmark_index(library, mode, tracks, args, work_dir) -> dict:
+    fingerprint_db = os.path.join(work_dir, f"index_{len(tracks)}.fpdb")
+    started = time.perf_counter()
+    for cmd in add_hashes_cmds(library, mode, fingerprint_db, tracks, ncores=os.cpu_count() or 1):
+        await run(cmd)
+    ingest_seconds = time.perf_counter() - started
+
+    silence = os.path.join(work_dir, "silence.mp3")
+    await run(["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", f"anullsrc=r={SAMPLE_RATE}:cl=mono", "-t", "1", "-c:a", "libmp3lame", silence])
+    load_seconds = [(await timed(match_cmd(library, mode, fingerprint_db, silence)))[0] for _ in range(3)]
+
+    rng = random.Random(f"{args.seed}:queries:{len(tracks)}")
+    queries = [(rng.choice(tracks), rng.uniform(0, args.duration - EXCERPT_DURATION)) for _ in range(args.queries)]
+    distortions = {}
+    for distortion in args.distortions:
+        latency = []
+        matched = 0
+        for num, (track, offset) in enumerate(queries):
+            query = os.path.join(work_dir, f"query_{distortion}_{num}.mp3")
+            await make_query(track, offset, distortion, query)
+            elapsed, stdout = await timed(match_cmd(library, mode, fingerprint_db, query))
+            latency.append(elapsed)
+            matched += match_result(stdout) == os.path.splitext(os.path.basename(track))[0]
+            os.remove(query)
+        distortions[distortion] = {"recall": matched / len(queries), "match_seconds": summary(latency)}
+
+    return {
+        "tracks": len(tracks),
+        "ingest_seconds": ingest_seconds,
+        "ingest_tracks_per_second": len(tracks) / ingest_seconds,
+        "index_bytes": os.path.getsize(fingerprint_db),
+        "index_load_seconds": summary(load_seconds),
+        "queries": distortions,
+    }
+
+
+async def main(args):
+    corpus = await generate_corpus(args.corpus, max(args.sizes), args.duration, args.seed)
+    results = {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "seed": args.seed,
+        "track_duration": args.duration,
+        "backends": {},
+    }
+
+    for backend in args.backends:
+        library, mode = BACKENDS[backend]
+        if not os.path.exists(BACKEND_PATHS[library]):
+            logger.warning(f"{backend} is not installed at {BACKEND_PATHS[library]}, skipped")
+            results["backends"][backend] = {"skipped": True}
+            continue
+        results["backends"][backend] = {}
+        for size in sorted(args.sizes):
+            logger.info(f"Benchmarking {backend} with {size} tracks")
+            with tempfile.TemporaryDirectory() as work_dir:
+                results["backends"][backend][str(size)] = await benchmark_index(library, mode, corpus[:size], args, work_dir)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark fingerprinting backends on a synthetic corpus")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 90, 1000], help="number of tracks in the benchmarked indexes")
+    parser.add_argument("--queries", type=int, default=20, help="queries per index and distortion")
+    parser.add_argument("--duration", type=int, default=60, help="duration of every synthetic track in seconds")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=list(BACKENDS))
+    parser.add_argument("--distortions", nargs="+", default=list(DISTORTIONS), choices=list(DISTORTIONS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--corpus", default=os.path.join(tempfile.gettempdir(), "StravinskyBot_corpus"), help="directory of the generated corpus, reused between runs")
+    parser.add_argument("-o", "--output", help="write JSON results to file")
+
+    logger.remove()
+    logger.add(sys.stderr, level="INFO")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,158 @@
+"""
+End-to-end load test of the bot against the local fake Bot API server.
+
+Starts `python -m bot` in a temporary working directory (its own user_data,
+`bot/library` is linked from the repository), then simulates students which
+create a folder, upload samples and send voice queries. Reports throughput,
+end-to-end latency and queue wait of every job kind as JSON.
+
+Usage:
+    python -m benchmarks.loadtest --sample sample.mp3 --query query.ogg --students 200 --samples 2 --queries 3 -o loadtest.json
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+
+from benchmarks.common import summary
+from benchmarks.fake_bot_api import FakeBotAPI
+
+TOKEN = "123456:LOADTEST"
+REPOSITORY_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+QUEUED_TEXT = "Задача поставлена в очередь"
+STARTED_TEXT = "Выполняем..."
+FINISHED_TEXTS = ("Задача успешно завершена", "Задача завершилась с ошибкой")
+
+
+def has_text(text):
+    return lambda method, message: text in message.get("text", "")
+
+
+def button_data(message, prefix) -> str:
+    for row in message.get("reply_markup", {}).get("inline_keyboard", []):
+        for button in row:
+            if button.get("callback_data", "").startswith(prefix):
+                return button["callback_data"]
+
+
+async def run_job(api, chat_id, sent_at, kind, args, stats) -> dict:
+    """Waits for the job started by the last update and records its timings"""
+    queued_at, _, queued_message = await api.wait_for(chat_id, lambda method, message: method == "sendMessage" and QUEUED_TEXT in message["text"], args.timeout)
+    is_job_message = lambda method, message: method == "editMessageText" and message["message_id"] == queued_message["message_id"]
+    started_at, _, _ = await api.wait_for(chat_id, lambda method, message: is_job_message(method, message) and STARTED_TEXT in message["text"], args.timeout)
+    finished_at, _, message = await api.wait_for(chat_id, lambda method, message: is_job_message(method, message) and any(x in message["text"] for x in FINISHED_TEXTS), args.timeout)
+    stats.append({
+        "kind": kind,
+        "ok": FINISHED_TEXTS[0] in message["text"],
+        "end_to_end": finished_at - sent_at,
+        "queue_wait": started_at - queued_at,
+    })
+    return message
+
+
+async def student(api, chat_id, args, stats):
+    try:
+        api.send_text(chat_id, "/start")
+        _, _, message = await api.wait_for(chat_id, lambda method, message: method == "sendMessage", args.timeout)
+
+        api.press_button(chat_id, message, "create_new_folder")
+        _, _, message = await api.wait_for(chat_id, has_text("Введите название"), args.timeout)
+        api.send_text(chat_id, f"Quiz {chat_id}")
+        _, _, message = await api.wait_for(chat_id, lambda method, message: button_data(message, "manage_folder_menu:"), args.timeout)
+        folder_id = button_data(message, "manage_folder_menu:").split(":")[1]
+
+        for num in range(args.samples):
+            api.press_button(chat_id, message, f"upload_audio_sample_message:{folder_id}")
+            _, _, message = await api.wait_for(chat_id, has_text("режиме загрузки"), args.timeout)
+            sent_at = api.send_document(chat_id, "sample", f"Sample {num}{os.path.splitext(args.sample)[1]}")
+            message = await run_job(api, chat_id, sent_at, "upload_audio_sample", args, stats)
+
+        for num in range(args.queries):
+            api.press_button(chat_id, message, f"recognize_query_message:{folder_id}")
+            _, _, message = await api.wait_for(chat_id, has_text("режиме распознавания"), args.timeout)
+            sent_at = api.send_voice(chat_id, "query")
+            message = await run_job(api, chat_id, sent_at, "recognize_query", args, stats)
+    except asyncio.TimeoutError:
+        stats.append({"kind": "student", "ok": False, "timeout": True})
+
+
+def report(stats, elapsed, api) -> dict:
+    result = {"elapsed_seconds": elapsed, "api_calls": api.calls_count, "jobs": {}}
+    for kind in sorted({x["kind"] for x in stats}):
+        kind_stats = [x for x in stats if x["kind"] == kind]
+        finished = [x for x in kind_stats if "end_to_end" in x]
+        result["jobs"][kind] = {
+            "finished": len(finished),
+            "errors": len([x for x in kind_stats if not x["ok"]]),
+            "throughput_per_second": len(finished) / elapsed,
+            "end_to_end_seconds": summary([x["end_to_end"] for x in finished]),
+            "queue_wait_seconds": summary([x["queue_wait"] for x in finished]),
+        }
+    return result
+
+
+async def main(args):
+    api = FakeBotAPI(TOKEN, {"sample": os.path.abspath(args.sample), "query": os.path.abspath(args.query)})
+    await api.start(port=args.port)
+
+    with tempfile.TemporaryDirectory(prefix="StravinskyBot_loadtest_") as work_dir:
+        # Bot uses paths relative to the working directory
+        os.makedirs(os.path.join(work_dir, "bot"))
+        os.symlink(os.path.join(REPOSITORY_PATH, "bot", "library"), os.path.join(work_dir, "bot", "library"))
+        env = dict(
+            os.environ,
+            PYTHONPATH=REPOSITORY_PATH,
+            TELEGRAM_API_TOKEN=TOKEN,
+            TELEGRAM_API_SERVER=f"http://127.0.0.1:{args.port}",
+            AUDIO_LIBRARY=args.library,
+            AUDFPRINT_MODE=args.mode,
+            # Every uploaded sample is the same audio file, the bot would reject them as copies
+            DUPLICATE_MIN_COUNT="0",
+        )
+        if args.job_workers is not None:
+            env["JOB_WORKERS"] = str(args.job_workers)
+        bot_process = await asyncio.create_subprocess_exec(sys.executable, "-m", "bot", cwd=work_dir, env=env, stdout=asyncio.subprocess.DEVNULL, stderr=None if args.bot_logs else asyncio.subprocess.DEVNULL)
+
+        stats = []
+        started = time.perf_counter()
+        try:
+            students = []
+            for num in range(args.students):
+                students.append(asyncio.create_task(student(api, 100000 + num, args, stats)))
+                await asyncio.sleep(args.ramp_up / args.students)
+            await asyncio.gather(*students)
+        finally:
+            elapsed = time.perf_counter() - started
+            bot_process.terminate()
+            await bot_process.wait()
+            await api.stop()
+
+    output = json.dumps(report(stats, elapsed, api), indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the bot against a local fake Bot API server")
+    parser.add_argument("--sample", required=True, help="audio file served for every uploaded sample")
+    parser.add_argument("--query", required=True, help="audio file served for every voice query")
+    parser.add_argument("--students", type=int, default=100)
+    parser.add_argument("--samples", type=int, default=1, help="samples uploaded by every student")
+    parser.add_argument("--queries", type=int, default=3, help="voice queries sent by every student")
+    parser.add_argument("--ramp-up", type=float, default=10, help="seconds during which students join")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for every bot response")
+    parser.add_argument("--library", default="1", help="1 - audfprint, 2 - SoundFingerprinting")
+    parser.add_argument("--mode", default="1", help="audfprint mode: 0 - accurate, 1 - fast")
+    parser.add_argument("--job-workers", type=int, help="JOB_WORKERS of the bot process")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--bot-logs", action="store_true", help="show bot stderr")
+    parser.add_argument("-o", "--output", help="write JSON results to file")
+
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,123 @@
+"""
+Size and lookup speed of the compact postings (benchmarks/compact_postings.py) compared to
+the audfprint hash table.
+
+audfprint keeps a dense table of 2^hashbits x depth 32 bit entries in memory,
+whatever the number of stored hashes is, and saves it as a gzipped pickle.
+The benchmark converts audfprint databases (or a synthetic index shaped like
+a folder of audfprint tracks) into compact postings and reports bytes per
+hash of both, in memory and on disk, plus encoding time and latency of the
+vectorized lookup of a query.
+
+Usage:
+    python -m benchmarks.postings --fpdb bot/user_data/data/*/*/fingerprint_db/*.fpdb -o postings.json
+    python -m benchmarks.postings --tracks 90 900 -o postings.json
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+import numpy as np
+
+from bot.fingerprint import AUDFPRINT_PATH
+from benchmarks.compact_postings import Postings
+from benchmarks.common import summary
+
+# audfprint defaults
+HASHBITS = 20
+DEPTH = 100
+TIME_BITS = 14
+
+
+def audfprint_postings(fingerprint_db) -> tuple:
+    """Returns (hashes, tracks, times, time bits, table bytes in memory) of audfprint database"""
+    sys.path.insert(0, os.path.dirname(AUDFPRINT_PATH))
+    import hash_table
+
+    table = hash_table.HashTable(fingerprint_db)
+    stored = np.arange(table.depth) < np.minimum(table.counts, table.depth)[:, None]
+    hashes = np.nonzero(stored)[0].astype(np.uint32)
+    entries = table.table[stored].astype(np.uint64)
+    time_mask = np.uint64((1 << table.maxtimebits) - 1)
+    return hashes, entries >> np.uint64(table.maxtimebits), entries & time_mask, table.maxtimebits, table.table.nbytes + table.counts.nbytes
+
+
+def synthetic_postings(tracks, hashes_per_track, seed) -> tuple:
+    """Uniformly distributed hashes, as landmark hashes of unrelated tracks are"""
+    rng = np.random.default_rng(seed)
+    count = tracks * hashes_per_track
+    hashes = rng.integers(0, 2 ** HASHBITS, count, dtype=np.uint32)
+    track_ids = np.repeat(np.arange(tracks, dtype=np.uint64), hashes_per_track)
+    times = rng.integers(0, 2 ** TIME_BITS, count, dtype=np.uint64)
+    # Table size of audfprint does not depend on the number of hashes: int32 entries and counts
+    return hashes, track_ids, times, TIME_BITS, 2 ** HASHBITS * (DEPTH + 1) * 4
+
+
+def benchmark_postings(name, hashes, tracks, times, time_bits, table_bytes, args, file_bytes=None) -> dict:
+    started = time.perf_counter()
+    postings = Postings.from_arrays(hashes, tracks, times, time_bits)
+    encode_seconds = time.perf_counter() - started
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        postings_file = os.path.join(work_dir, "postings.npz")
+        postings.save(postings_file)
+        compact_file_bytes = os.path.getsize(postings_file)
+
+    rng = np.random.default_rng(args.seed)
+    lookup_seconds = []
+    for _ in range(args.queries):
+        # Query is a mix of hashes from the index and unknown ones
+        query = np.concatenate((rng.choice(hashes, args.query_hashes // 2), rng.integers(0, 2 ** 32, args.query_hashes - args.query_hashes // 2, dtype=np.uint32)))
+        started = time.perf_counter()
+        postings.lookup(query)
+        lookup_seconds.append(time.perf_counter() - started)
+
+    count = len(hashes)
+    result = {
+        "name": name,
+        "hashes": count,
+        "audfprint_memory_bytes_per_hash": table_bytes / count,
+        "compact_memory_bytes_per_hash": postings.nbytes / count,
+        "compact_file_bytes_per_hash": compact_file_bytes / count,
+        "encode_seconds": encode_seconds,
+        "lookup_seconds": summary(lookup_seconds),
+    }
+    if file_bytes is not None:
+        result["audfprint_file_bytes_per_hash"] = file_bytes / count
+    return result
+
+
+def main(args):
+    results = []
+    for fingerprint_db in args.fpdb:
+        hashes, tracks, times, time_bits, table_bytes = audfprint_postings(fingerprint_db)
+        results.append(benchmark_postings(fingerprint_db, hashes, tracks, times, time_bits, table_bytes, args, os.path.getsize(fingerprint_db)))
+    for tracks_count in args.tracks:
+        hashes, tracks, times, time_bits, table_bytes = synthetic_postings(tracks_count, args.hashes_per_track, args.seed)
+        results.append(benchmark_postings(f"synthetic {tracks_count} tracks", hashes, tracks, times, time_bits, table_bytes, args))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare compact postings with audfprint hash table")
+    parser.add_argument("--fpdb", nargs="*", default=[], help="audfprint databases")
+    parser.add_argument("--tracks", type=int, nargs="*", default=[], help="sizes of synthetic indexes in tracks")
+    parser.add_argument("--hashes-per-track", type=int, default=10000, help="about 3 minutes of audio in audfprint fast mode")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--query-hashes", type=int, default=1000, help="hashes of one query")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="write JSON results to file")
+
+    args = parser.parse_args()
+    if not args.fpdb and not args.tracks:
+        args.tracks = [10, 90, 900]
+    main(args)
@@ -0,0 +1,96 @@
+"""
+Accuracy and latency of the audio preprocessing profiles.
+
+Reference set layout:
+    samples/<sample name>.mp3         - audio samples added to the fingerprint database
+    queries/<sample name>/<any>.ogg   - queries which must match the sample
+
+Usage:
+    python -m benchmarks.preprocessing --samples samples/ --queries queries/ --library 1 --mode 0 -o preprocessing.json
+"""
+
+import os
+import sys
+import json
+import asyncio
+import argparse
+import tempfile
+
+from loguru import logger
+
+from bot.audio import preprocessing_cmd, query_trim_filter
+from bot.fingerprint import add_hashes_cmds, match_cmd
+from bot.constants import AudioPreprocessingEnum
+from benchmarks.common import run, timed, match_result, audio_files, summary
+
+
+async def benchmark_profile(profile, samples, queries, args, work_dir) -> dict:
+    processed_samples = []
+    preprocessing_time = []
+    for sample in samples:
+        processed_sample = os.path.join(work_dir, os.path.splitext(os.path.basename(sample))[0] + ".mp3")
+        elapsed, _ = await timed(preprocessing_cmd(sample, processed_sample, profile))
+        preprocessing_time.append(elapsed)
+        processed_samples.append(processed_sample)
+
+    fingerprint_db = os.path.join(work_dir, "fingerprint.fpdb")
+    for cmd in add_hashes_cmds(args.library, args.mode, fingerprint_db, processed_samples, ncores=os.cpu_count() or 1):
+        await run(cmd)
+
+    query_preprocessing_time = []
+    match_time = []
+    matched = 0
+    for expected, query in queries:
+        processed_query = os.path.join(work_dir, "query.mp3")
+        trim_filter = query_trim_filter(args.silence_threshold, args.max_duration) if args.trim else None
+        elapsed, _ = await timed(preprocessing_cmd(query, processed_query, profile, trim_filter, args.max_duration * 2 if args.trim else None))
+        query_preprocessing_time.append(elapsed)
+
+        elapsed, stdout = await timed(match_cmd(args.library, args.mode, fingerprint_db, processed_query))
+        match_time.append(elapsed)
+        matched += match_result(stdout) == expected
+
+    return {
+        "sample_preprocessing_seconds": summary(preprocessing_time),
+        "query_preprocessing_seconds": summary(query_preprocessing_time),
+        "match_seconds": summary(match_time),
+        "accuracy": matched / len(queries) if queries else None,
+    }
+
+
+async def main(args):
+    samples = audio_files(args.samples)
+    queries = [
+        (expected, query)
+        for expected in sorted(os.listdir(args.queries)) if os.path.isdir(os.path.join(args.queries, expected))
+        for query in audio_files(os.path.join(args.queries, expected))
+    ]
+
+    results = {"samples": len(samples), "queries": len(queries), "library": args.library, "mode": args.mode, "trim": args.trim, "profiles": {}}
+    for profile in args.profiles:
+        with tempfile.TemporaryDirectory() as work_dir:
+            logger.info(f"Benchmarking preprocessing profile {profile!r}")
+            results["profiles"][profile] = await benchmark_profile(profile, samples, queries, args, work_dir)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark audio preprocessing profiles")
+    parser.add_argument("--samples", required=True, help="directory with reference audio samples")
+    parser.add_argument("--queries", required=True, help="directory with subdirectories of queries named after samples")
+    parser.add_argument("--library", default="1", help="1 - audfprint, 2 - SoundFingerprinting")
+    parser.add_argument("--mode", default="1", help="audfprint mode: 0 - accurate, 1 - fast")
+    parser.add_argument("--profiles", nargs="+", default=[x.value for x in AudioPreprocessingEnum])
+    parser.add_argument("--no-trim", dest="trim", action="store_false", help="do not crop silence of queries like the bot does")
+    parser.add_argument("--silence-threshold", type=float, default=-45)
+    parser.add_argument("--max-duration", type=float, default=30)
+    parser.add_argument("-o", "--output", help="write JSON results to file")
+
+    logger.remove()
+    logger.add(sys.stderr, level="INFO")
+    asyncio.run(main(parser.parse_args()))
@@ -1,6 +1,11 @@
 import os
-import sys
 import json
+import time
+import signal
+import socket
+import asyncio
+import sqlite3
+import tracemalloc
 
 import shutil
 import logging
@@ -8,26 +13,54 @@ import dotenv
 
 from contextlib import suppress
 
+from loguru import logger
+
 from bot.loguru_handler import InterceptHandler
-from bot.queue import Queue
+from bot.jobs import Job, JobStore
+from bot.locks import folder_lock, active_folder_locks, file_version
+from bot.fingerprint import precompute_cmd, hashes_file, add_hashes_cmds, match_cmd, remove_hashes_cmds, is_missing_track_error, command_processes, MATCH_TIME_KEY
+from bot.audio import probe_duration, split_audio, segment_name, query_trim_filter, preprocessing_cmd
 from bot.database import SQLighter
+from bot.supervisor import CommandError, execute_command, stream_command, configure_supervisor, process_slots
 from bot.other import *
-from bot.constants import AudioLibrariesEnum, AudfprintModeEnum
+from bot.constants import AudioLibrariesEnum, AudfprintModeEnum, AudioPreprocessingEnum, AUDIO_FILE_EXTENSIONS, SEGMENT_MIN_DURATION, PREPROCESSING_TIMEOUT, FINGERPRINT_TIMEOUT, MATCH_TIMEOUT, ZIP_MAX_FILE_SIZE, ZIP_MAX_TOTAL_SIZE
 from bot.backup import backup_sender
+from bot.archive import archive_audio
+from bot.profiling import profiler, loop_lag_monitor, memory_snapshot, start_memory_tracing, stop_memory_tracing
+from bot.metrics import Gauge, MeasuredBot, measure_stage, measure_methods, start_metrics_server, QUEUE_WAIT_SECONDS, JOB_SECONDS, JOBS, MATCH_RESULTS
 
 from aiogram.utils.callback_data import CallbackData
 from aiogram import Bot, Dispatcher, executor, types
 from aiogram.dispatcher.filters.state import State, StatesGroup
 from aiogram.dispatcher import FSMContext
 from aiogram.contrib.fsm_storage.files import JSONStorage
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
 
 os.makedirs("bot/user_data", exist_ok=True)
 
 dotenv.load_dotenv()
 
 TELEGRAM_API_TOKEN = os.getenv("TELEGRAM_API_TOKEN")
+TELEGRAM_API_SERVER = os.getenv("TELEGRAM_API_SERVER")
 AUDIO_LIBRARY = os.getenv("AUDIO_LIBRARY")
 AUDFPRINT_MODE = os.getenv("AUDFPRINT_MODE")
+AUDIO_PREPROCESSING = os.getenv("AUDIO_PREPROCESSING") or AudioPreprocessingEnum.full.value
+QUERY_SILENCE_THRESHOLD = float(os.getenv("QUERY_SILENCE_THRESHOLD") or -45)
+QUERY_MAX_DURATION = float(os.getenv("QUERY_MAX_DURATION") or 30)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS") or 6)
+MAX_SUBPROCESSES = int(os.getenv("MAX_SUBPROCESSES") or os.cpu_count() or 1)
+SUBPROCESS_MEMORY_LIMIT_MB = int(os.getenv("SUBPROCESS_MEMORY_LIMIT_MB") or 0)
+METRICS_HOST = os.getenv("METRICS_HOST") or "127.0.0.1"
+METRICS_PORT = int(os.getenv("METRICS_PORT") or 0)
+METRICS_LOG = os.getenv("METRICS_LOG")
+ADMIN_IDS = [int(x) for x in (os.getenv("ADMIN_IDS") or "").split(",") if x.strip()]
+PROFILE_JOBS = int(os.getenv("PROFILE_JOBS") or 10)
+TRACE_MEMORY = os.getenv("TRACE_MEMORY") == "1"
+MAX_FOLDERS = int(os.getenv("MAX_FOLDERS") or 10)
+MAX_FOLDER_SAMPLES = int(os.getenv("MAX_FOLDER_SAMPLES") or 90)
+DUPLICATE_MIN_COUNT = int(os.getenv("DUPLICATE_MIN_COUNT") or 50)
+JOB_LEASE_SECONDS = 60
+JOB_MAX_ATTEMPTS = 3
 
 def validate_env_vars():
     if TELEGRAM_API_TOKEN is None:
@@ -36,19 +69,40 @@ def validate_env_vars():
         raise ValueError("Please set AUDIO_LIBRARY in .env file")
     if AUDIO_LIBRARY == AudioLibrariesEnum.audfprint.value and (AUDFPRINT_MODE is None or AUDFPRINT_MODE not in [AudfprintModeEnum.accurate.value, AudfprintModeEnum.fast.value]):
         raise ValueError("Please set AUDFPRINT_MODE in .env file")
+    if AUDIO_PREPROCESSING not in [x.value for x in AudioPreprocessingEnum]:
+        raise ValueError("Please set AUDIO_PREPROCESSING in .env file")
 
 validate_env_vars()
 
+configure_supervisor(MAX_SUBPROCESSES, SUBPROCESS_MEMORY_LIMIT_MB * 1024 * 1024 or None)
+
 memory_storage = JSONStorage("bot/user_data/fsm_state_storage.json")
 
 logging.basicConfig(handlers=[InterceptHandler()], level=0, force=True)
+if METRICS_LOG:
+    # Every metric observation as a JSON line
+    logger.add(METRICS_LOG, level="TRACE", serialize=True, filter=lambda record: "metric" in record["extra"], rotation="100 MB")
 
-bot = Bot(token=TELEGRAM_API_TOKEN)
+bot = MeasuredBot(token=TELEGRAM_API_TOKEN, server=TelegramAPIServer.from_base(TELEGRAM_API_SERVER) if TELEGRAM_API_SERVER else TELEGRAM_PRODUCTION)
 dp = Dispatcher(bot, storage=memory_storage)
 
 db = SQLighter("bot/user_data/database.db")
-
-queue = Queue(maxsize=6)
+measure_methods(db, "database")
+db.init()
+
+# Matches only read the published snapshot of the folder database
+jobs = JobStore(os.getenv("JOBS_DATABASE") or "bot/user_data/jobs.db", read_only_kinds=("recognize_query",))
+measure_methods(jobs, "jobs")
+jobs.init()
+job_workers_shutdown = asyncio.Event()
+job_workers_task = None
+metrics_runner = None
+
+# Read on the event loop, readers of the WAL job table never wait for writers
+Gauge("stravinsky_jobs", "Jobs in the job table by status", ["status"], function=lambda: {(status,): jobs.count_jobs(status) for status in ("queued", "running")})
+Gauge("stravinsky_active_folders", "Folders which fingerprint databases are being read or written by this process", function=lambda: len(active_folder_locks()))
+# Backends load the whole fingerprint database into memory of every running match or add
+Gauge("stravinsky_resident_index_bytes", "Size of fingerprint databases being read or written by this process", function=lambda: sum(os.path.getsize(lock.fingerprint_db) for lock in active_folder_locks() if os.path.exists(lock.fingerprint_db)))
 
 manage_folder_cb = CallbackData("manage_folder_menu", "folder_id")
 remove_folder_cb = CallbackData("remove_folder_message", "folder_id")
@@ -56,6 +110,8 @@ remove_folder_process_cb = CallbackData("remove_folder_process", "folder_id")
 upload_audio_sample_cb = CallbackData("upload_audio_sample_message", "folder_id")
 remove_audio_sample_cb = CallbackData("remove_audio_sample_message", "folder_id")
 recognize_query_cb = CallbackData("recognize_query_message", "folder_id")
+bulk_upload_audio_samples_cb = CallbackData("bulk_upload_audio_samples_message", "folder_id")
+bulk_upload_start_cb = CallbackData("bulk_upload_start", "folder_id")
 
 
 class CreateFolder(StatesGroup):
@@ -66,6 +122,9 @@ class Upload_Sample(StatesGroup):
     step_1 = State()
     step_2 = State()
 
+class BulkUpload(StatesGroup):
+    step_1 = State()
+
 class RemoveSample(StatesGroup):
     step_1 = State()
 
@@ -78,6 +137,14 @@ class TaskException(Exception):
         self.ex = ex
 
 
+async def save_job_stage(job: Job, stage: int, managment_msg: types.Message, **payload) -> None:
+    """Saves progress of the job, after restart it continues from `stage`"""
+    job.stage = stage
+    job.payload.update(payload, message=managment_msg.to_python())
+    await asyncio.to_thread(jobs.checkpoint, job)
+
+
+@measure_stage("download_file")
 async def download_file(message, file_id, destination) -> types.Message:
     message_text = message.text + "\n\nЗагрузка файла..."
     await message.edit_text(message_text + " Выполняем...")
@@ -91,12 +158,18 @@ async def download_file(message, file_id, destination) -> types.Message:
         managment_msg = await message.edit_text(message_text + " Готово ✅")
         return managment_msg
 
-async def audio_processing(message, input_file, output_file) -> types.Message:
+@measure_stage("audio_processing")
+async def audio_processing(message, input_file, output_file, trim=False) -> types.Message:
+    """trim - crop silence and cap duration of the voice query before analysis"""
     message_text = message.text + "\n\nПроверка на целостность, нормализация и конвертация аудио файла..."
     await message.edit_text(message_text + " Выполняем...")
     try:
-        cmd = ['ffmpeg-normalize', '-q', '-vn', input_file, '-c:a', 'libmp3lame', '-o', output_file]
-        await execute_command(cmd)
+        if trim:
+            # Decoding is limited too, leading silence may take up to QUERY_MAX_DURATION
+            cmd = preprocessing_cmd(input_file, output_file, AUDIO_PREPROCESSING, query_trim_filter(QUERY_SILENCE_THRESHOLD, QUERY_MAX_DURATION), QUERY_MAX_DURATION * 2)
+        else:
+            cmd = preprocessing_cmd(input_file, output_file, AUDIO_PREPROCESSING)
+        await execute_command(cmd, timeout=PREPROCESSING_TIMEOUT)
         assert os.path.exists(output_file)
     except Exception as ex:
         managment_msg = await message.edit_text(message_text + " Критическая ошибка, отмена... 📛")
@@ -105,25 +178,68 @@ async def audio_processing(message, input_file, output_file) -> types.Message:
         managment_msg = await message.edit_text(message_text + " Готово ✅")
         return managment_msg
 
-async def register_audio_hashes(message, input_file, fingerprint_db) -> types.Message:
-    message_text = message.text + "\n\nЗагружаем викторину в базу..."
-    await message.edit_text(message_text + " Выполняем...")
+async def archive_audio_sample(input_file):
+    """Keeps the original audio sample for reindexing, returns its archive digest. Upload doesn't fail without it"""
+    try:
+        return await archive_audio(input_file)
+    except Exception as ex:
+        logging.warning(f"Can't archive {input_file}: {ex!r}")
+
+@measure_stage("split_audio_segments")
+async def split_audio_segments(message, input_files: list) -> tuple:
+    """
+    Splits long recordings into overlapping segments.
+    Returns list of (segment file, segment offset) lists and durations of the input files.
+    """
     try:
+        durations = await asyncio.gather(*map(probe_duration, input_files))
+    except Exception as ex:
+        managment_msg = await message.edit_text(message.text + "\n\nОпределение длительности аудио... Критическая ошибка, отмена...")
+        raise TaskException(managment_msg.text, ex)
 
-        if os.path.exists(fingerprint_db) is False:
-            db_hashes_add_method = 'new'
-        elif os.path.exists(fingerprint_db) is True:
-            db_hashes_add_method = 'add'
+    if max(durations) < SEGMENT_MIN_DURATION:
+        return message, [[(input_file, 0)] for input_file in input_files], durations
 
-        if AUDIO_LIBRARY == AudioLibrariesEnum.audfprint.value:
-            if AUDFPRINT_MODE == AudfprintModeEnum.accurate.value:
-                cmd = [sys.executable, 'bot/library/audfprint-master/audfprint.py', db_hashes_add_method, '-d', fingerprint_db, input_file, '-n', '120', '-X', '-F', '0']
-            elif AUDFPRINT_MODE == AudfprintModeEnum.fast.value:
-                cmd = [sys.executable, 'bot/library/audfprint-master/audfprint.py', db_hashes_add_method, '-d', fingerprint_db, input_file]
-        elif AUDIO_LIBRARY == AudioLibrariesEnum.SoundFingerprinting.value:
-            cmd = ['bot/library/SoundFingerprinting/SoundFingerprinting.AddictedCS.Demo', "add", fingerprint_db, input_file]
+    message_text = message.text + "\n\nРазбиваем длинные записи на фрагменты..."
+    await message.edit_text(message_text + " Выполняем...")
+    try:
+        segments = await asyncio.gather(*(split_audio(input_file, duration) for input_file, duration in zip(input_files, durations)))
+    except Exception as ex:
+        managment_msg = await message.edit_text(message_text + " Критическая ошибка, отмена...")
+        raise TaskException(managment_msg.text, ex)
+    else:
+        managment_msg = await message.edit_text(message_text + f" Готово ✅ Фрагментов: {sum(map(len, segments))}")
+        return managment_msg, segments, durations
+
+@measure_stage("precompute_hashes")
+async def precompute_hashes(message, input_files: list) -> types.Message:
+    """
+    Analyzes all files once on all CPU cores, duplicate check and registration
+    read their hashes from `hashes_file`
+    """
+    cmd = precompute_cmd(AUDIO_LIBRARY, AUDFPRINT_MODE, input_files, ncores=min(len(input_files), process_slots()))
+    if cmd is None:
+        return message
+
+    message_text = message.text + "\n\nАнализируем аудио..."
+    await message.edit_text(message_text + " Выполняем...")
+    try:
+        await execute_command(cmd, timeout=FINGERPRINT_TIMEOUT, processes=command_processes(cmd))
+    except Exception as ex:
+        managment_msg = await message.edit_text(message_text + " Критическая ошибка, отмена...")
+        raise TaskException(managment_msg.text, ex)
+    else:
+        managment_msg = await message.edit_text(message_text + " Готово ✅")
+        return managment_msg
 
-        await execute_command(cmd)
+@measure_stage("register_audio_hashes")
+async def register_audio_hashes(message, input_files: list, fingerprint_db) -> types.Message:
+    """Adds precomputed hashes of the audio sample, or of all segments of the long one"""
+    message_text = message.text + "\n\nЗагружаем викторину в базу..."
+    await message.edit_text(message_text + " Выполняем...")
+    try:
+        for cmd in add_hashes_cmds(AUDIO_LIBRARY, AUDFPRINT_MODE, fingerprint_db, input_files):
+            await execute_command(cmd, timeout=FINGERPRINT_TIMEOUT, processes=command_processes(cmd))
 
         assert os.path.exists(fingerprint_db)
     except Exception as ex:
@@ -133,32 +249,38 @@ async def register_audio_hashes(message, input_file, fingerprint_db) -> types.Me
         managment_msg = await message.edit_text(message_text + " Готово ✅")
         return managment_msg
 
-async def match_audio_query(message, input_file, fingerprint_db) -> types.Message:
+@measure_stage("match_audio_query")
+async def match_audio_query(message, input_file, fingerprint_db, folder_id) -> types.Message:
     message_text = message.text + "\n\nИщем викторину в базе..."
     await message.edit_text(message_text + " Выполняем...")
     try:
-        if AUDIO_LIBRARY == AudioLibrariesEnum.audfprint.value:
-            if AUDFPRINT_MODE == AudfprintModeEnum.accurate.value:
-                cmd = [sys.executable, 'bot/library/audfprint/audfprint.py', 'match', '-d', fingerprint_db, input_file, '-n', '120', '-D', '2000', '-X', '-F', '18']
-            elif AUDFPRINT_MODE == AudfprintModeEnum.fast.value:
-                cmd = [sys.executable, 'bot/library/audfprint/audfprint.py', 'match', '-d', fingerprint_db, input_file]
-        elif AUDIO_LIBRARY == AudioLibrariesEnum.SoundFingerprinting.value:
-            cmd = ['bot/library/SoundFingerprinting/SoundFingerprinting.AddictedCS.Demo', 'match', fingerprint_db, input_file]
-
-        process = await execute_command(cmd)
         command_result = None
-
-        async with process_output_lines(process) as lines:
-            async for line in lines:
-                try:
-                    command_result = json.loads(line)["RESULT"]
-                except Exception as ex:
-                    pass
-        
+        match_time = 0
+
+        # Backends print line-delimited JSON, the last result wins
+        async for line in stream_command(match_cmd(AUDIO_LIBRARY, AUDFPRINT_MODE, fingerprint_db, input_file), timeout=MATCH_TIMEOUT):
+            try:
+                output = json.loads(line)
+                command_result, match_time = output["RESULT"], float(output.get(MATCH_TIME_KEY) or 0)
+            except Exception as ex:
+                pass
+
+        if command_result is None:
+            MATCH_RESULTS.inc(result="error")
+            raise ValueError("Fingerprinting backend printed no result")
+        MATCH_RESULTS.inc(result="nomatch" if command_result == "NOMATCH" else "match")
         if command_result == "NOMATCH":
             result = "Это божественная музыка! Возможно, именно поэтому я не могу найти её. 😇"
+        elif (segment := db.select_audio_sample_segment(folder_id, os.path.splitext(os.path.basename(command_result))[0])) is not None:
+            # Segment of the long recording, report position in the recording
+            audio_sample_name, segment_offset, duration = segment
+            position = max(segment_offset + match_time, 0)
+            if duration is not None:
+                # Query may be aligned past the end of the last segment
+                position = min(position, duration)
+            result = f"{audio_sample_name}, ~{format_timestamp(position)}"
         else:
-            result = command_result
+            result = os.path.splitext(os.path.basename(command_result))[0]
 
         assert os.path.exists(fingerprint_db)
     except Exception as ex:
@@ -168,25 +290,76 @@ async def match_audio_query(message, input_file, fingerprint_db) -> types.Messag
         managment_msg = await message.edit_text(message_text + f" Готово ✅\n\nРезультат:\n{result}\n")
         return managment_msg
 
-async def delete_audio_hashes(message, fingerprint_db, sample_name, state: FSMContext) -> types.Message:
-    user_data = await state.get_data()
-    message_text = message.text + "\n\nУдаляем викторину из базы..."
+@measure_stage("find_duplicate_samples")
+async def find_duplicate_samples(message, samples: list, fingerprint_db, folder_id) -> tuple:
+    """
+    Matches files (segments) of every new audio sample, list of (name, files), against the folder database.
+    Sample is a copy of the existing one if at least half of its segments match it.
+    Returns names of the duplicated samples, None for the original ones.
+    """
+    if not DUPLICATE_MIN_COUNT or not os.path.exists(fingerprint_db):
+        return message, [None] * len(samples)
+
+    message_text = message.text + "\n\nИщем такие же викторины в папке..."
     await message.edit_text(message_text + " Выполняем...")
+
+    async def matched_sample_name(input_file):
+        command_result = None
+        for line in await execute_command(match_cmd(AUDIO_LIBRARY, AUDFPRINT_MODE, fingerprint_db, input_file, min_count=DUPLICATE_MIN_COUNT), timeout=MATCH_TIMEOUT):
+            with suppress(Exception):
+                command_result = json.loads(line)["RESULT"]
+        if command_result is None or command_result == "NOMATCH":
+            return None
+        result_name = os.path.splitext(os.path.basename(command_result))[0]
+        segment = db.select_audio_sample_segment(folder_id, result_name)
+        return segment[0] if segment is not None else result_name
+
     try:
-        folder_samples = db.select_folder_samples(user_data["folder_id"])
+        # All files are matched at once, the supervisor limits number of running match processes
+        matched_names = await asyncio.gather(*(asyncio.gather(*map(matched_sample_name, files)) for _, files in samples))
+        duplicates = []
+        for (audio_sample_name, files), names in zip(samples, matched_names):
+            matches = {}
+            for name in names:
+                # Hashes of the sample itself are already there if the job was interrupted before registration
+                if name is not None and name != audio_sample_name:
+                    matches[name] = matches.get(name, 0) + 1
+            best_match = max(matches, key=matches.get, default=None)
+            duplicates.append(best_match if best_match is not None and matches[best_match] * 2 >= len(files) else None)
+    except Exception as ex:
+        managment_msg = await message.edit_text(message_text + " Критическая ошибка, отмена...")
+        raise TaskException(managment_msg.text, ex)
+    else:
+        duplicates_count = len([x for x in duplicates if x is not None])
+        managment_msg = await message.edit_text(message_text + (f" Найдено копий: {duplicates_count}" if duplicates_count else " Готово ✅"))
+        return managment_msg, duplicates
 
-        if len(folder_samples) == 1:
+@measure_stage("delete_audio_hashes")
+async def delete_audio_hashes(message, fingerprint_db, sample_files: list, remove_database: bool) -> types.Message:
+    message_text = message.text + "\n\nУдаляем викторину из базы..."
+    await message.edit_text(message_text + " Выполняем...")
+    try:
+        if remove_database:
+            # Removed working copy removes the whole fingerprint database on publish
             os.remove(fingerprint_db)
-            return
-
-        if AUDIO_LIBRARY == AudioLibrariesEnum.audfprint.value:
-            cmd = [sys.executable, 'bot/library/audfprint-master/audfprint.py', 'remove', '-d', fingerprint_db, sample_name, '-H', '2']
-        elif AUDIO_LIBRARY == AudioLibrariesEnum.SoundFingerprinting.value:
-            cmd = ['bot/library/SoundFingerprinting/SoundFingerprinting.AddictedCS.Demo', 'remove', fingerprint_db, sample_name]
-        
-        await execute_command(cmd)
-        
-        assert os.path.exists(fingerprint_db)
+        else:
+            track_names = [[hashes_file(AUDIO_LIBRARY, sample_file) for sample_file in sample_files]]
+            if track_names[0] != sample_files:
+                # Samples added before hashes were precomputed are stored under their audio files
+                track_names.append(sample_files)
+            for names in track_names:
+                try:
+                    for cmd in remove_hashes_cmds(AUDIO_LIBRARY, fingerprint_db, names):
+                        await execute_command(cmd, timeout=FINGERPRINT_TIMEOUT, processes=command_processes(cmd))
+                except CommandError as ex:
+                    if not is_missing_track_error(AUDIO_LIBRARY, ex.stderr):
+                        raise
+                else:
+                    break
+            else:
+                # Interrupted attempt of the job has already removed the hashes
+                logging.warning(f"Audio sample is not in {fingerprint_db}, considering it removed")
+            assert os.path.exists(fingerprint_db)
     except Exception as ex:
        managment_msg = await message.edit_text(message_text + " Критическая ошибка, отмена...")
        raise TaskException(managment_msg.text, ex)
@@ -194,6 +367,83 @@ async def delete_audio_hashes(message, fingerprint_db, sample_name, state: FSMCo
         managment_msg = await message.edit_text(message_text + " Готово ✅")
         return managment_msg
 
+@measure_stage("bulk_download_files")
+async def bulk_download_files(message, files: list, destination) -> tuple:
+    """
+    Downloads all files of the bulk upload and unpacks ZIP archives.
+    Returns list of (audio file, file_unique_id).
+    """
+    message_text = message.text + f"\n\nЗагрузка файлов ({len(files)})..."
+    await message.edit_text(message_text + " Выполняем...")
+    semaphore = asyncio.Semaphore(4)
+
+    async def download(file_info) -> list:
+        file_path = os.path.join(destination, file_info["file_unique_id"] + os.path.splitext(file_info["file_name"])[1].lower())
+        async with semaphore:
+            await bot.download_file_by_id(file_info["file_id"], file_path)
+        assert os.path.exists(file_path)
+
+        # Every file gets its own directory, files with the same name don't overwrite each other
+        # and the second one is skipped as an existing sample name
+        file_destination = os.path.join(destination, file_info["file_unique_id"])
+        os.makedirs(file_destination, exist_ok=True)
+        if not file_path.endswith(".zip"):
+            # Keep original file name, it becomes sample name
+            audio_file = os.path.join(file_destination, os.path.basename(file_info["file_name"]))
+            os.replace(file_path, audio_file)
+            return [(audio_file, file_info["file_unique_id"])]
+
+        extracted_files = await asyncio.to_thread(extract_audio_files, file_path, file_destination, ZIP_MAX_FILE_SIZE, ZIP_MAX_TOTAL_SIZE, MAX_FOLDER_SAMPLES)
+        os.remove(file_path)
+        return [(audio_file, f'{file_info["file_unique_id"]}/{os.path.basename(audio_file)}') for audio_file in extracted_files]
+
+    try:
+        audio_files = [audio_file for result in await asyncio.gather(*map(download, files)) for audio_file in result]
+    except Exception as ex:
+        managment_msg = await message.edit_text(message_text + " Критическая ошибка, отмена...")
+        raise TaskException(managment_msg.text, ex)
+    else:
+        managment_msg = await message.edit_text(message_text + f" Готово ✅ Найдено аудио файлов: {len(audio_files)}")
+        return managment_msg, audio_files
+
+@measure_stage("bulk_audio_processing")
+async def bulk_audio_processing(message, files: list) -> types.Message:
+    """Normalizes and converts (input file, output file) pairs in parallel, one ffmpeg process per CPU core"""
+    message_text = message.text + f"\n\nПроверка на целостность, нормализация и конвертация аудио файлов ({len(files)})..."
+    await message.edit_text(message_text + " Выполняем...")
+    semaphore = asyncio.Semaphore(os.cpu_count() or 1)
+
+    async def process(input_file, output_file):
+        async with semaphore:
+            await execute_command(preprocessing_cmd(input_file, output_file, AUDIO_PREPROCESSING), timeout=PREPROCESSING_TIMEOUT)
+        assert os.path.exists(output_file)
+
+    try:
+        await asyncio.gather(*(process(input_file, output_file) for input_file, output_file in files))
+    except Exception as ex:
+        managment_msg = await message.edit_text(message_text + " Критическая ошибка, отмена... 📛")
+        raise TaskException(managment_msg.text, ex)
+    else:
+        managment_msg = await message.edit_text(message_text + " Готово ✅")
+        return managment_msg
+
+@measure_stage("bulk_register_audio_hashes")
+async def bulk_register_audio_hashes(message, input_files: list, fingerprint_db) -> types.Message:
+    """Adds precomputed hashes of all files and writes the fingerprint database once"""
+    message_text = message.text + f"\n\nЗагружаем викторины в базу ({len(input_files)})..."
+    await message.edit_text(message_text + " Выполняем...")
+    try:
+        for cmd in add_hashes_cmds(AUDIO_LIBRARY, AUDFPRINT_MODE, fingerprint_db, input_files):
+            await execute_command(cmd, timeout=FINGERPRINT_TIMEOUT, processes=command_processes(cmd))
+
+        assert os.path.exists(fingerprint_db)
+    except Exception as ex:
+        managment_msg = await message.edit_text(message_text + " Критическая ошибка, отмена...")
+        raise TaskException(managment_msg.text, ex)
+    else:
+        managment_msg = await message.edit_text(message_text + " Готово ✅")
+        return managment_msg
+
 
 @dp.message_handler(lambda message: db.select_user(message.chat.id) is None)
 async def new_user_message(message: types.Message):
@@ -242,8 +492,8 @@ async def folder_list_menu_message(message: types.Message, messaging_type="edit"
 
 @dp.callback_query_handler(text="create_new_folder")
 async def create_folder_step_1_message(call: types.CallbackQuery):
-    if len(db.select_user_folders(call.message.chat.id)) >= 10:
-        await call.answer('Максимальное количество папок - 10. Удалите не нужные папки и повторите попытку.', True)
+    if len(db.select_user_folders(call.message.chat.id)) >= MAX_FOLDERS:
+        await call.answer(f'Максимальное количество папок - {MAX_FOLDERS}. Удалите не нужные папки и повторите попытку.', True)
         return
 
     keyboard_markup = types.InlineKeyboardMarkup()
@@ -319,11 +569,12 @@ async def delete_folder_step_2_message(call: types.CallbackQuery, callback_data:
     shutil.rmtree(path_list.processed_query_audio())
 
     # Delete audiofingerprint database
-    if os.path.exists(path_list.fingerprint_db()):
-        os.remove(path_list.fingerprint_db())
+    async with folder_lock(path_list.fingerprint_db()).write() as fingerprint_db:
+        with suppress(FileNotFoundError):
+            os.remove(fingerprint_db)
 
-    for sample in folder_samples:
-        db.unregister_audio_sample(folder_id, sample[1])
+        for sample in folder_samples:
+            db.unregister_audio_sample(folder_id, sample[1])
 
     db.delete_folder(folder_id)
 
@@ -342,6 +593,8 @@ async def manage_folder_menu_message(call: types.CallbackQuery, callback_data: d
     keyboard_markup = types.InlineKeyboardMarkup()
     upload_audio_samples_btn = types.InlineKeyboardButton('Загрузить викторины 📤', callback_data=upload_audio_sample_cb.new(folder_id))
     keyboard_markup.row(upload_audio_samples_btn)
+    bulk_upload_audio_samples_btn = types.InlineKeyboardButton('Массовая загрузка / ZIP 📦', callback_data=bulk_upload_audio_samples_cb.new(folder_id))
+    keyboard_markup.row(bulk_upload_audio_samples_btn)
     remove_audio_samples_btn = types.InlineKeyboardButton('Удалить викторину 🗑', callback_data=remove_audio_sample_cb.new(folder_id))
     keyboard_markup.row(remove_audio_samples_btn)
     quiz_mode_btn = types.InlineKeyboardButton('Распознать викторину 🔎', callback_data=recognize_query_cb.new(folder_id))
@@ -370,8 +623,8 @@ async def upload_audio_sample_message(call: types.CallbackQuery, callback_data:
     folder_info = db.select_folder(folder_id)
     folder_samples = db.select_folder_samples(folder_id)
 
-    if len(folder_samples) > 90:
-        await call.answer('Максимальное возможное количество викторин в папке - 90', True)
+    if len(folder_samples) > MAX_FOLDER_SAMPLES:
+        await call.answer(f'Максимальное возможное количество викторин в папке - {MAX_FOLDER_SAMPLES}', True)
         return
 
     keyboard_markup = types.InlineKeyboardMarkup()
@@ -421,7 +674,7 @@ async def upload_audio_sample_step_1_message(message: types.Message, state: FSMC
     await state.update_data({'audio_sample_name': user_data["audio_sample_file_name"]})
 
     # Проверяем расширение файла
-    if user_data["audio_sample_file_extensions"].lower() in ('.aac', '.wav', '.mp3', '.wma', '.ogg', '.flac', '.opus'):
+    if user_data["audio_sample_file_extensions"].lower() in AUDIO_FILE_EXTENSIONS:
         # await Upload_Sample.step_2.set()
 
         # await message.reply(
@@ -444,12 +697,10 @@ async def upload_audio_sample_step_2_message(message: types.Message, state: FSMC
     #     user_data['audio_sample_name'] = message.text.replace('\n', ' ')
 
     user_data = await state.get_data()
-    folder_info = db.select_folder(user_data["folder_id"])
 
     file_id = user_data["audio_sample_file_id"]
     audio_sample_name = user_data["audio_sample_name"]
     audio_sample_full_name = f'{audio_sample_name}{user_data["audio_sample_file_extensions"]}'
-    path_list = path(message.chat.id, folder_info[1])
 
     keyboard_markup = types.InlineKeyboardMarkup()
     back_btn = types.InlineKeyboardButton('«      ', callback_data=manage_folder_cb.new(user_data["folder_id"]))
@@ -468,37 +719,283 @@ async def upload_audio_sample_step_2_message(message: types.Message, state: FSMC
     # await state.finish()
 
     managment_msg = await message.reply('Задача поставлена в очередь, ожидайте...')
-
-    await queue.put_item(message.chat.id)
+    await asyncio.to_thread(jobs.enqueue, "upload_audio_sample", message.chat.id, {
+        "message": managment_msg.to_python(),
+        "folder_id": user_data["folder_id"],
+        "file_id": file_id,
+        "file_unique_id": user_data["audio_sample_file_unique_id"],
+        "audio_sample_name": audio_sample_name,
+        "audio_sample_full_name": audio_sample_full_name,
+    })
+
+async def upload_audio_sample_job(job: Job):
+    payload = job.payload
+    managment_msg = types.Message.to_object(payload["message"])
+    folder_info = db.select_folder(payload["folder_id"])
+    audio_sample_name = payload["audio_sample_name"]
+    path_list = path(job.chat_id, folder_info[1])
+    tmp_audio_sample = path_list.tmp_audio_samples(payload["audio_sample_full_name"])
+    processed_audio_sample = path_list.processed_audio_samples(audio_sample_name + ".mp3")
 
     try:
-        # Stage 0 : download file
-        managment_msg = await download_file(managment_msg, file_id, path_list.tmp_audio_samples(audio_sample_full_name))
-        # Stage 1 : check audio files for integrity and mormalize, convert them
-        managment_msg = await audio_processing(managment_msg, path_list.tmp_audio_samples(audio_sample_full_name), path_list.processed_audio_samples(audio_sample_name + ".mp3"))
-        # Stage 2 : analyze current audio sample hashes
-        managment_msg = await register_audio_hashes(managment_msg, path_list.processed_audio_samples(audio_sample_name + ".mp3"), path_list.fingerprint_db())
-        # Stage 3 : register current audio sample hashes
-        db.register_audio_sample(user_data["folder_id"], user_data["audio_sample_name"], user_data["audio_sample_file_unique_id"])
+        if job.stage <= 3 and audio_sample_name not in db.select_job_audio_samples(payload["folder_id"], job.job_id) and audio_sample_name.lower() in [x[1].lower() for x in db.select_folder_samples(payload["folder_id"])]:
+            # Names are checked when the job is enqueued, an upload with the same name may be queued before it
+            raise TaskException(managment_msg.text + "\n\nВикторина с таким же названием уже существует", ValueError("Audio sample name is taken"))
+        if job.stage <= 0:
+            # Stage 0 : download file
+            managment_msg = await download_file(managment_msg, payload["file_id"], tmp_audio_sample)
+            await save_job_stage(job, 1, managment_msg)
+        if job.stage <= 1:
+            # Stage 1 : check audio files for integrity and mormalize, convert them
+            managment_msg = await audio_processing(managment_msg, tmp_audio_sample, processed_audio_sample)
+            await save_job_stage(job, 2, managment_msg, archive_digest=await archive_audio_sample(tmp_audio_sample))
+        if job.stage <= 2:
+            # Stage 2 : split long recording into overlapping segments
+            managment_msg, (segments,), (duration,) = await split_audio_segments(managment_msg, [processed_audio_sample])
+            managment_msg = await precompute_hashes(managment_msg, [segment_file for segment_file, _ in segments])
+            await save_job_stage(job, 3, managment_msg, segments=segments, duration=duration)
+        if job.stage <= 3 and "fingerprint_db_version" in payload and file_version(path_list.fingerprint_db()) == payload["fingerprint_db_version"]:
+            # Job was interrupted right after publishing of the database with the audio sample
+            await save_job_stage(job, 4, managment_msg)
+        if job.stage <= 3:
+            segments = payload["segments"]
+            hashes_files = [hashes_file(AUDIO_LIBRARY, segment_file) for segment_file, _ in segments]
+            # Registration of the interrupted attempt was not published
+            db.unregister_job_audio_samples(payload["folder_id"], job.job_id)
+            # Stage 3 : reject re-encoded or renamed copy of the existing audio sample
+            async with folder_lock(path_list.fingerprint_db()).read() as fingerprint_db:
+                managment_msg, (duplicate,) = await find_duplicate_samples(managment_msg, [(audio_sample_name, hashes_files)], fingerprint_db, payload["folder_id"])
+            if duplicate is not None:
+                raise TaskException(managment_msg.text + f'\n\nЭта викторина уже существует в папке под названием "{duplicate}"', ValueError("Duplicate audio sample"))
+            # Analyze current audio sample hashes, new version of the folder database is published atomically
+            async with folder_lock(path_list.fingerprint_db()).write() as fingerprint_db:
+                managment_msg = await register_audio_hashes(managment_msg, hashes_files, fingerprint_db)
+                # Working copy keeps its version when it is published
+                await save_job_stage(job, 3, managment_msg, fingerprint_db_version=file_version(fingerprint_db))
+                # Stage 4 : register current audio sample before the database is published, reindex sees both of them or none
+                db.register_audio_sample(payload["folder_id"], audio_sample_name, payload["file_unique_id"], payload.get("archive_digest"), job.job_id, payload.get("duration"))
+                if len(segments) > 1:
+                    db.register_audio_sample_segments(payload["folder_id"], audio_sample_name, [(segment_name(audio_sample_name, segment_offset), segment_offset) for _, segment_offset in segments])
+            await save_job_stage(job, 4, managment_msg)
     except TaskException as task_exception:
-        logging.exception(task_exception.ex)
+        error = task_exception.ex
         message_text = task_exception.text + "\n\nЗадача завершилась с ошибкой"
+    except Exception as ex:
+        error = ex
+        message_text = managment_msg.text + "\n\nЗадача завершилась с ошибкой"
     else:
+        error = None
         message_text = managment_msg.text + "\n\nЗадача успешно завершена"
-    finally:
-        keyboard_markup = types.InlineKeyboardMarkup()
-        manage_folder_menu_message_btn = types.InlineKeyboardButton('« Вернутся к текущей папке', callback_data=manage_folder_cb.new(user_data["folder_id"]))
-        upload_sample_btn = types.InlineKeyboardButton('» Загрузить еще одну викторину', callback_data=upload_audio_sample_cb.new(user_data["folder_id"]))
-        keyboard_markup.row(manage_folder_menu_message_btn)
-        keyboard_markup.row(upload_sample_btn)
-        await managment_msg.edit_text(message_text, reply_markup=keyboard_markup)
 
+    keyboard_markup = types.InlineKeyboardMarkup()
+    manage_folder_menu_message_btn = types.InlineKeyboardButton('« Вернутся к текущей папке', callback_data=manage_folder_cb.new(payload["folder_id"]))
+    upload_sample_btn = types.InlineKeyboardButton('» Загрузить еще одну викторину', callback_data=upload_audio_sample_cb.new(payload["folder_id"]))
+    keyboard_markup.row(manage_folder_menu_message_btn)
+    keyboard_markup.row(upload_sample_btn)
+    await managment_msg.edit_text(message_text, reply_markup=keyboard_markup)
+
+    for tmp_file in [tmp_audio_sample, processed_audio_sample] + [tmp_file for segment_file, _ in payload.get("segments", []) for tmp_file in (segment_file, hashes_file(AUDIO_LIBRARY, segment_file))]:
+        with suppress(FileNotFoundError):
+            os.remove(tmp_file)
+
+    if error is not None:
+        # User is notified, the worker records the job as failed
+        raise error
+
+
+@dp.callback_query_handler(bulk_upload_audio_samples_cb.filter(), state='*')
+async def bulk_upload_audio_samples_message(call: types.CallbackQuery, callback_data: dict, state: FSMContext):
+    folder_id = int(callback_data['folder_id'])
+    folder_info = db.select_folder(folder_id)
+    folder_samples = db.select_folder_samples(folder_id)
+
+    if len(folder_samples) > MAX_FOLDER_SAMPLES:
+        await call.answer(f'Максимальное возможное количество викторин в папке - {MAX_FOLDER_SAMPLES}', True)
+        return
+
+    keyboard_markup = types.InlineKeyboardMarkup()
+    back_btn = types.InlineKeyboardButton('«      ', callback_data=manage_folder_cb.new(folder_id))
+    keyboard_markup.row(back_btn)
+    await call.message.edit_text(
+                    f'Вы работаете с папкой "{folder_info[1]}", в режиме массовой загрузки викторин\n\n'
+                    'Отправьте сразу несколько аудио файлов или ZIP архив с ними, затем нажмите "Начать загрузку". Названия файлов станут названиями викторин;\n\n'
+                    'Поддерживаемые форматы - mp3, wav, wma, ogg, flac, aac, opus, zip;\n\n'
+                    'Максимальный размер файла - 20 мб, это лимит установленный Телеграмом для ботов;',
+                    reply_markup=keyboard_markup)
+    await BulkUpload.step_1.set()
+    await state.update_data({"folder_id": folder_id, "bulk_files": []})
+    await call.answer()
+
+@dp.message_handler(state=BulkUpload.step_1, content_types=types.ContentTypes.DOCUMENT | types.ContentTypes.AUDIO)
+async def bulk_upload_step_1_message(message: types.Message, state: FSMContext):
+    if message.content_type == "document":
+        audio_sample_file_info = message.document
+    elif message.content_type == "audio":
+        audio_sample_file_info = message.audio
+    name_file = audio_sample_file_info.file_name or ""
+    file_extensions = os.path.splitext(name_file)[1].lower()
+
+    user_data = await state.get_data()
+    keyboard_markup = types.InlineKeyboardMarkup()
+    start_btn = types.InlineKeyboardButton('Начать загрузку ▶️', callback_data=bulk_upload_start_cb.new(user_data["folder_id"]))
+    back_btn = types.InlineKeyboardButton('«      ', callback_data=manage_folder_cb.new(user_data["folder_id"]))
+    keyboard_markup.row(start_btn)
+    keyboard_markup.row(back_btn)
+
+    # Проверяем размер файла
+    if int(audio_sample_file_info.file_size) >= 20871520:
+        await message.reply(f'Размер файла "{name_file}" превышает 20 mb, файл пропущен', reply_markup=keyboard_markup)
+        return
+
+    # Проверяем расширение файла
+    if file_extensions not in AUDIO_FILE_EXTENSIONS + ('.zip',):
+        await message.reply(f'Формат файла "{name_file}" не поддерживается, файл пропущен', reply_markup=keyboard_markup)
+        return
+
+    # Проверка на загруженность файла в текущей папки через db
+    file_unique_id = audio_sample_file_info.file_unique_id
+    for sample in db.select_folder_samples(user_data["folder_id"]):
+        if sample[3] == file_unique_id:
+            await message.reply(f'Эта викторина уже существует в папке под названием "{sample[1]}", файл пропущен', reply_markup=keyboard_markup)
+            return
+
+    async with state.proxy() as user_data:
+        if file_unique_id not in [x["file_unique_id"] for x in user_data["bulk_files"]]:
+            user_data["bulk_files"].append({"file_id": audio_sample_file_info.file_id, "file_unique_id": file_unique_id, "file_name": name_file})
+        files_count = len(user_data["bulk_files"])
+
+    await message.reply(f'Файл "{name_file}" добавлен. Всего файлов: {files_count}\n\nОтправьте еще файлы или начните загрузку', reply_markup=keyboard_markup)
+
+@dp.callback_query_handler(bulk_upload_start_cb.filter(), state=BulkUpload.step_1)
+async def bulk_upload_step_2_message(call: types.CallbackQuery, callback_data: dict, state: FSMContext):
+    user_data = await state.get_data()
+    if not user_data.get("bulk_files"):
+        await call.answer('Сначала отправьте аудио файлы или ZIP архив', True)
+        return
+
+    await state.finish()
+    await call.answer()
+
+    folder_info = db.select_folder(user_data["folder_id"])
+    path_list = path(call.message.chat.id, folder_info[1])
+
+    managment_msg = await call.message.answer('Задача поставлена в очередь, ожидайте...')
+    await asyncio.to_thread(jobs.enqueue, "bulk_upload_audio_samples", call.message.chat.id, {
+        "message": managment_msg.to_python(),
+        "folder_id": user_data["folder_id"],
+        "bulk_files": user_data["bulk_files"],
+        "bulk_path": path_list.tmp_audio_samples(f"bulk_{generate_random_string(16)}"),
+    })
+
+async def bulk_upload_audio_samples_job(job: Job):
+    payload = job.payload
+    managment_msg = types.Message.to_object(payload["message"])
+    folder_id = payload["folder_id"]
+    folder_info = db.select_folder(folder_id)
+    path_list = path(job.chat_id, folder_info[1])
+    bulk_path = payload["bulk_path"]
+
+    try:
+        if job.stage <= 0:
+            os.makedirs(bulk_path, exist_ok=True)
+            # Stage 0 : download files and unpack archives
+            managment_msg, audio_files = await bulk_download_files(managment_msg, payload["bulk_files"], bulk_path)
+
+            samples = []
+            skipped_files = []
+            folder_samples = db.select_folder_samples(folder_id)
+            samples_names = [x[1].lower() for x in folder_samples]
+            samples_unique_ids = [x[3] for x in folder_samples]
+            for audio_file, file_unique_id in audio_files:
+                audio_sample_name = os.path.splitext(os.path.basename(audio_file))[0]
+                if len(audio_sample_name) >= 180 or audio_sample_name.lower() in samples_names or file_unique_id in samples_unique_ids or len(folder_samples) + len(samples) > MAX_FOLDER_SAMPLES:
+                    skipped_files.append(os.path.basename(audio_file))
+                    continue
+                samples_names.append(audio_sample_name.lower())
+                samples.append((audio_sample_name, audio_file, file_unique_id))
+            await save_job_stage(job, 1, managment_msg, samples=samples, skipped_files=skipped_files)
+
+        samples = payload["samples"]
+        if not samples:
+            raise TaskException(managment_msg.text + "\n\nНет новых викторин для загрузки", ValueError("No new audio samples"))
+
+        if job.stage <= 1:
+            # Stage 1 : check audio files for integrity and mormalize, convert them in parallel
+            managment_msg = await bulk_audio_processing(managment_msg, [(audio_file, path_list.processed_audio_samples(audio_sample_name + ".mp3")) for audio_sample_name, audio_file, _ in samples])
+            archive_digests = await asyncio.gather(*(archive_audio_sample(audio_file) for _, audio_file, _ in samples))
+            await save_job_stage(job, 2, managment_msg, archive_digests=archive_digests)
+        if job.stage <= 2:
+            # Stage 2 : split long recordings into overlapping segments
+            managment_msg, segments, durations = await split_audio_segments(managment_msg, [path_list.processed_audio_samples(audio_sample_name + ".mp3") for audio_sample_name, _, _ in samples])
+            managment_msg = await precompute_hashes(managment_msg, [segment_file for sample_segments in segments for segment_file, _ in sample_segments])
+            await save_job_stage(job, 3, managment_msg, segments=segments, durations=durations)
+        if job.stage <= 3 and "fingerprint_db_version" in payload and file_version(path_list.fingerprint_db()) == payload["fingerprint_db_version"]:
+            # Job was interrupted right after publishing of the database with the audio samples
+            await save_job_stage(job, 4, managment_msg)
+        if job.stage <= 3:
+            segments = payload["segments"]
+            # Registration of the interrupted attempt was not published
+            db.unregister_job_audio_samples(folder_id, job.job_id)
+            # Stage 3 : skip re-encoded or renamed copies of the existing audio samples
+            async with folder_lock(path_list.fingerprint_db()).read() as fingerprint_db:
+                managment_msg, duplicates = await find_duplicate_samples(managment_msg, [(audio_sample_name, [hashes_file(AUDIO_LIBRARY, segment_file) for segment_file, _ in sample_segments]) for (audio_sample_name, _, _), sample_segments in zip(samples, segments)], fingerprint_db, folder_id)
+            if any(duplicates):
+                originals = [num for num, duplicate in enumerate(duplicates) if duplicate is None]
+                archive_digests = payload.get("archive_digests") or [None] * len(samples)
+                durations = payload.get("durations") or [None] * len(samples)
+                skipped_files = payload["skipped_files"] + [f'{os.path.basename(samples[num][1])} (копия "{duplicate}")' for num, duplicate in enumerate(duplicates) if duplicate is not None]
+                for num, duplicate in enumerate(duplicates):
+                    if duplicate is not None:
+                        for tmp_file in [path_list.processed_audio_samples(samples[num][0] + ".mp3")] + [tmp_file for segment_file, _ in segments[num] for tmp_file in (segment_file, hashes_file(AUDIO_LIBRARY, segment_file))]:
+                            with suppress(FileNotFoundError):
+                                os.remove(tmp_file)
+                samples, segments = [samples[num] for num in originals], [segments[num] for num in originals]
+                await save_job_stage(job, 3, managment_msg, samples=samples, segments=segments, archive_digests=[archive_digests[num] for num in originals], durations=[durations[num] for num in originals], skipped_files=skipped_files)
+                if not samples:
+                    raise TaskException(managment_msg.text + "\n\nНет новых викторин для загрузки", ValueError("No new audio samples"))
+            # Analyze all audio samples hashes and publish the folder database once
+            async with folder_lock(path_list.fingerprint_db()).write() as fingerprint_db:
+                managment_msg = await bulk_register_audio_hashes(managment_msg, [hashes_file(AUDIO_LIBRARY, segment_file) for sample_segments in segments for segment_file, _ in sample_segments], fingerprint_db)
+                # Working copy keeps its version when it is published
+                await save_job_stage(job, 3, managment_msg, fingerprint_db_version=file_version(fingerprint_db))
+                # Stage 4 : register audio samples before the database is published
+                archive_digests = payload.get("archive_digests") or [None] * len(samples)
+                durations = payload.get("durations") or [None] * len(samples)
+                for (audio_sample_name, _, file_unique_id), sample_segments, archive_digest, duration in zip(samples, segments, archive_digests, durations):
+                    db.register_audio_sample(folder_id, audio_sample_name, file_unique_id, archive_digest, job.job_id, duration)
+                    if len(sample_segments) > 1:
+                        db.register_audio_sample_segments(folder_id, audio_sample_name, [(segment_name(audio_sample_name, segment_offset), segment_offset) for _, segment_offset in sample_segments])
+            await save_job_stage(job, 4, managment_msg)
+    except TaskException as task_exception:
+        error = task_exception.ex
+        message_text = task_exception.text + "\n\nЗадача завершилась с ошибкой"
+    except Exception as ex:
+        error = ex
+        message_text = managment_msg.text + "\n\nЗадача завершилась с ошибкой"
+    else:
+        error = None
+        message_text = managment_msg.text + f"\n\nЗадача успешно завершена, загружено викторин: {len(payload['samples'])}"
+
+    if payload.get("skipped_files"):
+        message_text += "\n\nПропущены файлы (превышен лимит, слишком длинное название или викторина уже существует):\n" + "\n".join(payload["skipped_files"])
+
+    keyboard_markup = types.InlineKeyboardMarkup()
+    manage_folder_menu_message_btn = types.InlineKeyboardButton('« Вернутся к текущей папке', callback_data=manage_folder_cb.new(folder_id))
+    keyboard_markup.row(manage_folder_menu_message_btn)
+    await managment_msg.edit_text(message_text[:4096], reply_markup=keyboard_markup)
+
+    shutil.rmtree(bulk_path, ignore_errors=True)
+    for audio_sample_name, _, _ in payload.get("samples", []):
         with suppress(FileNotFoundError):
-            os.remove(path_list.tmp_audio_samples(audio_sample_full_name))
             os.remove(path_list.processed_audio_samples(audio_sample_name + ".mp3"))
+    for segment_file, _ in [segment for sample_segments in payload.get("segments", []) for segment in sample_segments]:
+        for tmp_file in (segment_file, hashes_file(AUDIO_LIBRARY, segment_file)):
+            with suppress(FileNotFoundError):
+                os.remove(tmp_file)
 
-        await queue.get_item(message.chat.id)
-        queue.task_done()
+    if error is not None:
+        # User is notified, the worker records the job as failed
+        raise error
 
 
 @dp.callback_query_handler(remove_audio_sample_cb.filter(), state='*')
@@ -530,36 +1027,62 @@ async def remove_audio_sample_step_1_message(message: types.Message, state: FSMC
 
     await state.finish()
 
-    folder_info = db.select_folder(user_data["folder_id"])
-
-    path_list = path(message.chat.id, folder_info[1])
-
     if user_data['chosen_sample'] == "<<< Отмена >>>":
-        await message.reply('Вы отменили операцию', reply_markup=keyboard_markup)
+        await message.reply('Вы отменили операцию', reply_markup=types.ReplyKeyboardRemove())
         return
 
     managment_msg = await message.reply('Задача поставлена в очередь, ожидайте...')
-
-    await queue.put_item(message.chat.id)
+    await asyncio.to_thread(jobs.enqueue, "remove_audio_sample", message.chat.id, {
+        "message": managment_msg.to_python(),
+        "folder_id": user_data["folder_id"],
+        "chosen_sample": user_data["chosen_sample"],
+    })
+
+async def remove_audio_sample_job(job: Job):
+    payload = job.payload
+    managment_msg = types.Message.to_object(payload["message"])
+    folder_info = db.select_folder(payload["folder_id"])
+    path_list = path(job.chat_id, folder_info[1])
 
     try:
-        managment_msg = await delete_audio_hashes(managment_msg, path_list.fingerprint_db(), path_list.processed_audio_samples(user_data['chosen_sample'] + ".mp3"))
-        db.unregister_audio_sample(user_data["folder_id"], user_data['chosen_sample'])
+        if job.stage <= 0 and "fingerprint_db_version" in payload and file_version(path_list.fingerprint_db()) == payload["fingerprint_db_version"]:
+            # Job was interrupted right after publishing of the database without the audio sample
+            await save_job_stage(job, 1, managment_msg)
+        if job.stage <= 0:
+            # Stage 0 : remove audio sample hashes
+            async with folder_lock(path_list.fingerprint_db()).write() as fingerprint_db:
+                if "sample_names" not in payload:
+                    # Long recordings are stored in the fingerprint database as separate segments
+                    segments = db.select_audio_sample_segments(payload["folder_id"], payload['chosen_sample'])
+                    await save_job_stage(job, 0, managment_msg, sample_names=[segment for segment, _ in segments] or [payload['chosen_sample']])
+                # Interrupted attempt may have unregistered the audio sample already
+                last_sample = not [x for x in db.select_folder_samples(payload["folder_id"]) if x[1] != payload['chosen_sample']]
+                managment_msg = await delete_audio_hashes(managment_msg, fingerprint_db, [path_list.processed_audio_samples(sample_name + ".mp3") for sample_name in payload["sample_names"]], last_sample)
+                # Working copy keeps its version when it is published
+                await save_job_stage(job, 0, managment_msg, fingerprint_db_version=file_version(fingerprint_db))
+                # Stage 1 : unregister audio sample before the database is published
+                db.unregister_audio_sample(payload["folder_id"], payload['chosen_sample'])
+            await save_job_stage(job, 1, managment_msg)
     except TaskException as task_exception:
-        logging.exception(task_exception.ex)
+        error = task_exception.ex
         message_text = task_exception.text + "\n\nЗадача завершилась с ошибкой"
+    except Exception as ex:
+        error = ex
+        message_text = managment_msg.text + "\n\nЗадача завершилась с ошибкой"
     else:
+        error = None
         message_text = managment_msg.text + "\n\nЗадача успешно завершена"
-    finally:
-        keyboard_markup = types.InlineKeyboardMarkup()
-        manage_folder_menu_message_btn = types.InlineKeyboardButton('« Вернутся к текущей папке', callback_data=manage_folder_cb.new(user_data["folder_id"]))
-        upload_sample_btn = types.InlineKeyboardButton('» Удалить еще одну викторину', callback_data=remove_audio_sample_cb.new(user_data["folder_id"]))
-        keyboard_markup.row(manage_folder_menu_message_btn)
-        keyboard_markup.row(upload_sample_btn)
-        await managment_msg.edit_text(message_text, reply_markup=keyboard_markup)
 
-        await queue.get_item(message.chat.id)
-        queue.task_done()
+    keyboard_markup = types.InlineKeyboardMarkup()
+    manage_folder_menu_message_btn = types.InlineKeyboardButton('« Вернутся к текущей папке', callback_data=manage_folder_cb.new(payload["folder_id"]))
+    upload_sample_btn = types.InlineKeyboardButton('» Удалить еще одну викторину', callback_data=remove_audio_sample_cb.new(payload["folder_id"]))
+    keyboard_markup.row(manage_folder_menu_message_btn)
+    keyboard_markup.row(upload_sample_btn)
+    await managment_msg.edit_text(message_text, reply_markup=keyboard_markup)
+
+    if error is not None:
+        # User is notified, the worker records the job as failed
+        raise error
 
 @dp.callback_query_handler(recognize_query_cb.filter(), state='*')
 async def recognize_query_message(call: types.CallbackQuery, callback_data: dict, state: FSMContext):
@@ -586,10 +1109,8 @@ async def recognize_query_message(call: types.CallbackQuery, callback_data: dict
 @dp.message_handler(state=UploadQuery.step_1, content_types=types.ContentTypes.VOICE | types.ContentTypes.AUDIO)
 async def recognize_query_step_1_message(message: types.Message, state: FSMContext):
     user_data = await state.get_data()
-    folder_info = db.select_folder(user_data["folder_id"])
 
     random_str = generate_random_string(32)
-    path_list = path(message.chat.id, folder_info[1])
 
     if message.content_type == "voice":
         file_id = message.voice.file_id
@@ -603,7 +1124,7 @@ async def recognize_query_step_1_message(message: types.Message, state: FSMConte
         name_file = message.audio.file_name  # New in Bot API 5.0
         query_audio_file_extensions = os.path.splitext(name_file)[1]
 
-    if query_audio_file_extensions.lower() not in ('.aac', '.wav', '.mp3', '.wma', '.ogg', '.flac', '.opus'):
+    if query_audio_file_extensions.lower() not in AUDIO_FILE_EXTENSIONS:
         keyboard_markup = types.InlineKeyboardMarkup()
         back_btn = types.InlineKeyboardButton('«      ', callback_data=manage_folder_cb.new(user_data["folder_id"]))
         keyboard_markup.row(back_btn)
@@ -615,35 +1136,58 @@ async def recognize_query_step_1_message(message: types.Message, state: FSMConte
 
     await state.finish()
     managment_msg = await message.reply('Задача поставлена в очередь, ожидайте...')
-
-    await queue.put_item(message.chat.id)
+    await asyncio.to_thread(jobs.enqueue, "recognize_query", message.chat.id, {
+        "message": managment_msg.to_python(),
+        "folder_id": user_data["folder_id"],
+        "file_id": file_id,
+        "query_audio_full_name": query_audio_full_name,
+        "query_audio_name": query_audio_name,
+    })
+
+async def recognize_query_job(job: Job):
+    payload = job.payload
+    managment_msg = types.Message.to_object(payload["message"])
+    folder_info = db.select_folder(payload["folder_id"])
+    path_list = path(job.chat_id, folder_info[1])
+    tmp_query_audio = path_list.tmp_query_audio(payload["query_audio_full_name"])
+    processed_query_audio = path_list.processed_query_audio(payload["query_audio_name"] + ".mp3")
 
     try:
-        # Stage 0 : download file
-        managment_msg = await download_file(managment_msg, file_id, path_list.tmp_query_audio(query_audio_full_name))
-        # Stage 1 : check audio files for integrity and mormalize, convert them
-        managment_msg = await audio_processing(managment_msg, path_list.tmp_query_audio(query_audio_full_name), path_list.processed_query_audio(query_audio_name + ".mp3"))
-        # Stage 2 : match audio query
-        managment_msg = await match_audio_query(managment_msg, path_list.processed_query_audio(query_audio_name + ".mp3"), path_list.fingerprint_db())
+        if job.stage <= 0:
+            # Stage 0 : download file
+            managment_msg = await download_file(managment_msg, payload["file_id"], tmp_query_audio)
+            await save_job_stage(job, 1, managment_msg)
+        if job.stage <= 1:
+            # Stage 1 : check audio files for integrity and mormalize, convert them
+            managment_msg = await audio_processing(managment_msg, tmp_query_audio, processed_query_audio, trim=True)
+            await save_job_stage(job, 2, managment_msg)
+        # Stage 2 : match audio query against the last published snapshot of the folder database
+        async with folder_lock(path_list.fingerprint_db()).read() as fingerprint_db:
+            managment_msg = await match_audio_query(managment_msg, processed_query_audio, fingerprint_db, payload["folder_id"])
     except TaskException as task_exception:
-        logging.exception(task_exception.ex)
+        error = task_exception.ex
         message_text = task_exception.text + "\n\nЗадача завершилась с ошибкой"
+    except Exception as ex:
+        error = ex
+        message_text = managment_msg.text + "\n\nЗадача завершилась с ошибкой"
     else:
+        error = None
         message_text = managment_msg.text + "\n\nЗадача успешно завершена"
-    finally:
-        keyboard_markup = types.InlineKeyboardMarkup()
-        manage_folder_menu_message_btn = types.InlineKeyboardButton('« Вернутся к текущей папке', callback_data=manage_folder_cb.new(user_data["folder_id"]))
-        upload_sample_btn = types.InlineKeyboardButton('» Распознать еще одну викторину', callback_data=recognize_query_cb.new(user_data["folder_id"]))
-        keyboard_markup.row(manage_folder_menu_message_btn)
-        keyboard_markup.row(upload_sample_btn)
-        await managment_msg.edit_text(message_text, reply_markup=keyboard_markup)
-        
+
+    keyboard_markup = types.InlineKeyboardMarkup()
+    manage_folder_menu_message_btn = types.InlineKeyboardButton('« Вернутся к текущей папке', callback_data=manage_folder_cb.new(payload["folder_id"]))
+    upload_sample_btn = types.InlineKeyboardButton('» Распознать еще одну викторину', callback_data=recognize_query_cb.new(payload["folder_id"]))
+    keyboard_markup.row(manage_folder_menu_message_btn)
+    keyboard_markup.row(upload_sample_btn)
+    await managment_msg.edit_text(message_text, reply_markup=keyboard_markup)
+
+    for tmp_file in [tmp_query_audio, processed_query_audio]:
         with suppress(FileNotFoundError):
-            os.remove(path_list.tmp_query_audio(query_audio_full_name))
-            os.remove(path_list.processed_query_audio(query_audio_name + ".mp3"))
+            os.remove(tmp_file)
 
-        await queue.get_item(message.chat.id)
-        queue.task_done()
+    if error is not None:
+        # User is notified, the worker records the job as failed
+        raise error
 
 @dp.message_handler(commands=['help'], state='*')
 async def process_help_command_1(message: types.Message, messaging_type="start"):
@@ -706,10 +1250,41 @@ async def process_help_command_4(message: types.Message):
     keyboard_markup.row(back_btn, next_btn)
     await message.edit_text(message_text, reply_markup=keyboard_markup, parse_mode="HTML")
 
-# TODO: danger
-@dp.message_handler(commands=['backup'], state='*')
+@dp.message_handler(lambda message: message.chat.id in ADMIN_IDS, commands=['backup'], state='*')
 async def backup_message(msg: types.Message):
-    await backup_sender(msg.bot, msg.chat.id)
+    # /backup - changes since the last backup, /backup full - everything
+    await backup_sender(msg.bot, msg.chat.id, full=msg.get_args() == "full")
+
+@dp.message_handler(lambda message: message.chat.id in ADMIN_IDS, commands=['profile'], state='*')
+async def profile_message(msg: types.Message):
+    # /profile - status, /profile N - profile next N jobs, /profile off,
+    # /profile memory start|stop - tracing of memory allocations, /profile memory - tracemalloc snapshot
+    args = msg.get_args()
+    if args.isdigit():
+        session_path = profiler.start(int(args))
+        await msg.reply(f"Профилируем следующие {args} задач(и), профили будут в {session_path}")
+    elif args == "off":
+        profiler.stop()
+        await msg.reply("Профилирование остановлено")
+    elif args == "memory start":
+        start_memory_tracing()
+        await msg.reply("Отслеживание памяти включено, снимок: /profile memory")
+    elif args == "memory stop":
+        stop_memory_tracing()
+        await msg.reply("Отслеживание памяти выключено")
+    elif args == "memory":
+        if not tracemalloc.is_tracing():
+            await msg.reply("Отслеживание памяти выключено, включите его: /profile memory start")
+            return
+        snapshot_file, report = await asyncio.to_thread(memory_snapshot)
+        await msg.reply(report)
+        await msg.reply_document(types.InputFile(snapshot_file))
+    else:
+        await msg.reply(
+            f"Задержка цикла событий: {loop_lag_monitor.last_lag * 1000:.0f} мс, максимум {loop_lag_monitor.max_lag * 1000:.0f} мс\n"
+            f"Осталось профилировать задач: {profiler.remaining}, профили: {profiler.session_path}\n"
+            f"Отслеживание памяти: {'включено' if tracemalloc.is_tracing() else 'выключено'}"
+        )
 
 @dp.message_handler(content_types=types.ContentType.ANY, state='*')
 async def unknown_message(msg: types.Message):
@@ -738,10 +1313,124 @@ async def callback_handler(query: types.CallbackQuery, state):
         await query.answer()
         await process_help_command_4(query.message)
 
+job_handlers = {
+    "upload_audio_sample": upload_audio_sample_job,
+    "bulk_upload_audio_samples": bulk_upload_audio_samples_job,
+    "remove_audio_sample": remove_audio_sample_job,
+    "recognize_query": recognize_query_job,
+}
+
+async def run_job(job: Job):
+    with profiler.profile_job(job):
+        await job_handlers[job.kind](job)
+
+async def job_heartbeat(job: Job, job_task: asyncio.Task):
+    """Prolongs lease of the running job, cancels it if the lease was lost"""
+    while True:
+        await asyncio.sleep(JOB_LEASE_SECONDS / 3)
+        try:
+            leased = await asyncio.to_thread(jobs.heartbeat, job, JOB_LEASE_SECONDS)
+        except sqlite3.OperationalError as ex:
+            # Job table is busy, the lease is long enough for the next attempt
+            logging.warning(f"Can't prolong lease of job {job.job_id}: {ex}")
+            continue
+        if not leased:
+            logging.warning(f"Job {job.job_id} was leased by another worker, cancelling it")
+            job_task.cancel()
+            return
+
+async def job_worker(worker_id: str):
+    """Takes jobs from the job table until shutdown"""
+    Bot.set_current(bot)
+    lease_retry_delay = 1
+    while not job_workers_shutdown.is_set():
+        try:
+            job = await asyncio.to_thread(jobs.lease, worker_id, JOB_LEASE_SECONDS, JOB_MAX_ATTEMPTS)
+        except sqlite3.OperationalError as ex:
+            # Job table is locked by other processes longer than the connection timeout
+            logging.warning(f"Worker {worker_id} can't lease a job, retrying in {lease_retry_delay}s: {ex}")
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(job_workers_shutdown.wait(), lease_retry_delay)
+            lease_retry_delay = min(lease_retry_delay * 2, JOB_LEASE_SECONDS)
+            continue
+        lease_retry_delay = 1
+        if job is None:
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(job_workers_shutdown.wait(), 1)
+            continue
+
+        logging.info(f"Worker {worker_id} took job {job.job_id} ({job.kind}, stage {job.stage}, attempt {job.attempts})")
+        if job.attempts == 1:
+            QUEUE_WAIT_SECONDS.observe(time.time() - job.created_at, kind=job.kind)
+        # Job runs in its own task, so that it can be cancelled without stopping the worker
+        job_task = asyncio.create_task(run_job(job))
+        heartbeat = asyncio.create_task(job_heartbeat(job, job_task))
+        started = time.perf_counter()
+        try:
+            await job_task
+        except asyncio.CancelledError:
+            if not heartbeat.done():
+                # Worker itself is cancelled
+                raise
+            JOBS.inc(kind=job.kind, status='lost')
+        except Exception as ex:
+            logging.exception(ex)
+            await asyncio.to_thread(jobs.finish, job, 'failed', repr(ex))
+            JOBS.inc(kind=job.kind, status='failed')
+        else:
+            await asyncio.to_thread(jobs.finish, job)
+            JOBS.inc(kind=job.kind, status='done')
+        finally:
+            heartbeat.cancel()
+            JOB_SECONDS.observe(time.perf_counter() - started, kind=job.kind)
+
+async def run_job_workers(count: int):
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    try:
+        await asyncio.gather(*(job_worker(f"{worker_id}:{num}") for num in range(count)))
+    finally:
+        for num in range(count):
+            await asyncio.to_thread(jobs.release, f"{worker_id}:{num}")
+
+def log_memory_snapshot():
+    if not tracemalloc.is_tracing():
+        logging.warning("Memory allocations are not traced, set TRACE_MEMORY=1 to take snapshots")
+        return
+    snapshot_file, report = memory_snapshot()
+    logging.warning(f"Memory snapshot is saved to {snapshot_file}\n{report}")
+
+async def start_diagnostics():
+    """Serves metrics of this process if METRICS_PORT is set, starts event loop lag monitor and profiling signals"""
+    global metrics_runner
+    if METRICS_PORT:
+        metrics_runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+    loop_lag_monitor.start()
+    if TRACE_MEMORY:
+        start_memory_tracing()
+    loop = asyncio.get_running_loop()
+    # kill -USR1 <pid> - profile next PROFILE_JOBS jobs, kill -USR2 <pid> - memory snapshot
+    loop.add_signal_handler(signal.SIGUSR1, profiler.start, PROFILE_JOBS)
+    loop.add_signal_handler(signal.SIGUSR2, log_memory_snapshot)
+
+async def stop_diagnostics():
+    loop_lag_monitor.stop()
+    profiler.stop()
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+async def on_bot_startup(dp: Dispatcher):
+    global job_workers_task
+    await start_diagnostics()
+    if JOB_WORKERS > 0:
+        job_workers_task = asyncio.create_task(run_job_workers(JOB_WORKERS))
+
 async def on_bot_shutdown(dp: Dispatcher):
     logging.warning("Bot shutdown command recived...")
-    logging.warning("Waiting queue...")
-    await queue.join()
+    if job_workers_task is not None:
+        logging.warning("Waiting running jobs...")
+        job_workers_shutdown.set()
+        await job_workers_task
+    await stop_diagnostics()
 
 if __name__ == '__main__':
-    executor.start_polling(dp, on_shutdown=on_bot_shutdown)
+    executor.start_polling(dp, on_startup=on_bot_startup, on_shutdown=on_bot_shutdown)
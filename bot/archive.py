@@ -0,0 +1,41 @@
+"""Content-addressed archive of the original audio samples, fingerprint databases are rebuilt from it."""
+
+import os
+import asyncio
+
+from contextlib import suppress
+
+from bot.backup import file_digest
+from bot.supervisor import execute_command
+from bot.other import USER_DATA_PATH, generate_random_string
+from bot.constants import PREPROCESSING_TIMEOUT
+
+ARCHIVE_PATH = f"{USER_DATA_PATH}/archive"
+# Mono Opus is transparent enough for fingerprinting, about 1 MB per 3 minutes
+ARCHIVE_BITRATE = "48k"
+
+
+def archive_file(digest) -> str:
+    return f"{ARCHIVE_PATH}/{digest[:2]}/{digest}.opus"
+
+
+async def archive_audio(input_file) -> str:
+    """
+    Encodes audio file into Opus and stores it under sha256 of the encoded
+    file, returns the digest. Encoding is bit-exact, so the same file is
+    stored only once.
+    """
+    os.makedirs(ARCHIVE_PATH, exist_ok=True)
+    encoded_file = f"{ARCHIVE_PATH}/{generate_random_string(16)}.opus.tmp"
+    try:
+        await execute_command([
+            'ffmpeg', '-y', '-v', 'error', '-i', input_file, '-vn', '-map_metadata', '-1', '-fflags', '+bitexact', '-flags:a', '+bitexact',
+            '-ac', '1', '-c:a', 'libopus', '-b:a', ARCHIVE_BITRATE, '-f', 'opus', encoded_file
+        ], timeout=PREPROCESSING_TIMEOUT)
+        digest = await asyncio.to_thread(file_digest, encoded_file)
+        os.makedirs(os.path.dirname(archive_file(digest)), exist_ok=True)
+        os.replace(encoded_file, archive_file(digest))
+    finally:
+        with suppress(FileNotFoundError):
+            os.remove(encoded_file)
+    return digest
@@ -0,0 +1,77 @@
+"""Audio files helpers built on top of ffmpeg."""
+
+import os
+import json
+import asyncio
+
+from bot.supervisor import execute_command
+from bot.constants import AudioPreprocessingEnum, SEGMENT_MIN_DURATION, SEGMENT_LENGTH, SEGMENT_OVERLAP, PREPROCESSING_TIMEOUT
+
+
+async def probe_duration(input_file) -> float:
+    """Returns duration of audio file in seconds"""
+    cmd = ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'default=noprint_wrappers=1:nokey=1', input_file]
+    stdout = await execute_command(cmd, timeout=PREPROCESSING_TIMEOUT)
+    return float(stdout[0])
+
+
+def preprocessing_cmd(input_file, output_file, profile, pre_filter=None, max_input_duration=None) -> list:
+    """
+    Returns command which checks audio file for integrity, normalizes it
+    according to the preprocessing profile and converts it to mp3
+    """
+    if profile == AudioPreprocessingEnum.full.value:
+        cmd = ['ffmpeg-normalize', '-q', '-f', '-vn', input_file, '-c:a', 'libmp3lame', '-o', output_file]
+        if pre_filter:
+            cmd += ['-prf', pre_filter]
+        if max_input_duration:
+            # JSON list, a value starting with a dash would be parsed as an option
+            cmd += ['-ei', json.dumps(['-t', str(max_input_duration)])]
+        return cmd
+
+    audio_filters = [pre_filter] if pre_filter else []
+    if profile == AudioPreprocessingEnum.fast.value:
+        audio_filters.append('dynaudnorm')
+
+    cmd = ['ffmpeg', '-y', '-v', 'error']
+    if max_input_duration:
+        cmd += ['-t', str(max_input_duration)]
+    cmd += ['-i', input_file, '-vn']
+    if audio_filters:
+        cmd += ['-af', ','.join(audio_filters)]
+    return cmd + ['-c:a', 'libmp3lame', output_file]
+
+
+def query_trim_filter(silence_threshold: float, max_duration: float) -> str:
+    """
+    Returns ffmpeg filter chain which crops leading and trailing silence by
+    signal energy and caps duration of the remaining audio
+    """
+    silence_remove = f"silenceremove=start_periods=1:start_duration=0.1:start_threshold={silence_threshold}dB:detection=rms"
+    return f"{silence_remove},areverse,{silence_remove},areverse,atrim=duration={max_duration}"
+
+
+def segment_name(audio_sample_name, segment_offset) -> str:
+    return f"{audio_sample_name}@{int(segment_offset)}"
+
+
+async def split_audio(input_file, duration: float) -> list:
+    """
+    Splits long audio file into overlapping segments next to it, every segment
+    is named by `segment_name`. Returns list of (segment file, segment offset),
+    audio files shorter than SEGMENT_MIN_DURATION are not split.
+    """
+    if duration < SEGMENT_MIN_DURATION:
+        return [(input_file, 0)]
+
+    file_name, file_extensions = os.path.splitext(input_file)
+    step = SEGMENT_LENGTH - SEGMENT_OVERLAP
+    segments = [(f"{segment_name(file_name, offset)}{file_extensions}", offset) for offset in range(0, int(duration - SEGMENT_OVERLAP), step)]
+    semaphore = asyncio.Semaphore(os.cpu_count() or 1)
+
+    async def cut(segment_file, offset):
+        async with semaphore:
+            await execute_command(['ffmpeg', '-y', '-v', 'error', '-ss', str(offset), '-t', str(SEGMENT_LENGTH), '-i', input_file, '-c', 'copy', segment_file], timeout=PREPROCESSING_TIMEOUT)
+
+    await asyncio.gather(*(cut(segment_file, offset) for segment_file, offset in segments))
+    return segments
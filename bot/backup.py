@@ -1,14 +1,173 @@
-from bot.zip import aio_make_zip_file
+"""
+Incremental backups of the bot data.
+
+SQLite databases are copied with the online backup API, so the copy is
+consistent even while the bot writes to them. Other files (fingerprint
+databases, FSM storage) get into the archive only if they changed since the
+last sent backup, changes are found by size, mtime and sha256 saved in the
+manifest. The archive is written off the event loop straight into parts
+smaller than the Telegram upload limit, parts are joined back with
+`cat StravinskyBot_backup_*.zip.* > backup.zip`.
+"""
+
+import os
+import json
+import shutil
+import asyncio
+import hashlib
+import sqlite3
+import zipfile
+import tempfile
 
 from aiogram import types
 
 from datetime import datetime
-import os
+from contextlib import suppress
+
+from bot.other import USER_DATA_PATH
+
+BACKUP_PATH = "bot/user_data"
+MANIFEST_FILE = "bot/user_data/backup_manifest.json"
+# Bot API upload limit is 50 MB
+PART_SIZE = 45 * 1024 * 1024
+# Temporary and easily restorable data is not backed up
+EXCLUDED_PATHS = (f"{USER_DATA_PATH}/audio_sample/tmp", f"{USER_DATA_PATH}/audio_sample/processed", f"{USER_DATA_PATH}/query")
+EXCLUDED_SUFFIXES = (".db-wal", ".db-shm", ".db-journal", ".tmp", ".lock")
+
+
+class SplitWriter:
+    """Write-only file object which splits data into numbered part files"""
+
+    def __init__(self, base_name, part_size):
+        self.base_name = base_name
+        self.part_size = part_size
+        self.parts = []
+        self._file = None
+        self._written = 0
+
+    def write(self, data) -> int:
+        view = memoryview(data)
+        while view:
+            if self._file is None or self._written >= self.part_size:
+                self._next_part()
+            chunk = view[:self.part_size - self._written]
+            self._file.write(chunk)
+            self._written += len(chunk)
+            view = view[len(chunk):]
+        return len(data)
+
+    def _next_part(self):
+        if self._file is not None:
+            self._file.close()
+        self.parts.append(f"{self.base_name}.{len(self.parts) + 1:03d}")
+        self._file = open(self.parts[-1], "wb")
+        self._written = 0
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def snapshot_database(source, destination) -> None:
+    """Consistent copy of the live SQLite database"""
+    source_connection = sqlite3.connect(source)
+    destination_connection = sqlite3.connect(destination)
+    try:
+        with destination_connection:
+            source_connection.backup(destination_connection)
+    finally:
+        destination_connection.close()
+        source_connection.close()
+
+
+def file_digest(file_path) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        while chunk := file.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest() -> dict:
+    try:
+        with open(MANIFEST_FILE) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(manifest: dict) -> None:
+    with open(MANIFEST_FILE + ".tmp", "w") as file:
+        json.dump(manifest, file)
+    os.replace(MANIFEST_FILE + ".tmp", MANIFEST_FILE)
+
+
+def build_backup(work_dir, archive_name, full: bool) -> tuple:
+    """
+    Writes backup archive parts into work_dir.
+    Returns (part files, new manifest, number of changed files).
+    """
+    previous_manifest = {} if full else load_manifest()
+    manifest = {}
+    changed_files = []
+    databases = []
+
+    for root, dirs, files in os.walk(BACKUP_PATH):
+        dirs[:] = [x for x in dirs if os.path.join(root, x) not in EXCLUDED_PATHS]
+        for file_name in files:
+            file_path = os.path.join(root, file_name)
+            if file_path == MANIFEST_FILE or file_name.endswith(EXCLUDED_SUFFIXES):
+                continue
+            if file_name.endswith(".db"):
+                databases.append(file_path)
+                continue
+
+            with suppress(FileNotFoundError):
+                stat = os.stat(file_path)
+                previous = previous_manifest.get(file_path)
+                if previous and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime_ns:
+                    manifest[file_path] = previous
+                    continue
+                digest = file_digest(file_path)
+                manifest[file_path] = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "sha256": digest}
+                if previous is None or previous["sha256"] != digest:
+                    changed_files.append(file_path)
+
+    deleted_files = sorted(set(previous_manifest) - set(manifest))
+
+    writer = SplitWriter(os.path.join(work_dir, archive_name), PART_SIZE)
+    try:
+        with zipfile.ZipFile(writer, "w", zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+            for database in databases:
+                database_snapshot = os.path.join(work_dir, os.path.basename(database))
+                snapshot_database(database, database_snapshot)
+                archive.write(database_snapshot, database)
+                os.remove(database_snapshot)
+            for file_path in changed_files:
+                with suppress(FileNotFoundError):
+                    archive.write(file_path, file_path)
+            archive.writestr("backup_info.json", json.dumps({"full": full, "changed": changed_files, "deleted": deleted_files}, ensure_ascii=False, indent=2))
+    finally:
+        writer.close()
+
+    return writer.parts, manifest, len(changed_files)
 
 
-async def backup_sender(bot, user_id):
+async def backup_sender(bot, user_id, full=False):
     time_now = datetime.now()
-    date_time_str = time_now.strftime("%Y-%m-%d %H:%M:%S")
-    created_backup_file = await aio_make_zip_file(f"StravinskyBot_backup_{date_time_str}", "bot/user_data/")
-    await bot.send_document(user_id, types.InputFile(created_backup_file))
-    os.remove(created_backup_file)
+    date_time_str = time_now.strftime("%Y-%m-%d_%H-%M-%S")
+    work_dir = tempfile.mkdtemp(prefix="StravinskyBot_backup_")
+    try:
+        archive_name = f"StravinskyBot_backup_{date_time_str}{'_full' if full else ''}.zip"
+        parts, manifest, changed_files_count = await asyncio.to_thread(build_backup, work_dir, archive_name, full)
+        for num, part in enumerate(parts, 1):
+            caption = f"{'Полная' if full else 'Инкрементальная'} копия, часть {num}/{len(parts)}, изменено файлов: {changed_files_count}"
+            await bot.send_document(user_id, types.InputFile(part), caption=caption)
+        # Next incremental backup is based on this one only after it was delivered
+        await asyncio.to_thread(save_manifest, manifest)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
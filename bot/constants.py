@@ -1,9 +1,33 @@
 from enum import Enum
 
-class AudioLibrariesEnum(Enum, str):
+class AudioLibrariesEnum(str, Enum):
     audfprint = 1
     SoundFingerprinting = 2
 
-class AudfprintModeEnum(Enum, str):
+class AudfprintModeEnum(str, Enum):
     accurate = 0
-    fast = 1
\ No newline at end of file
+    fast = 1
+
+class AudioPreprocessingEnum(str, Enum):
+    # Two-pass EBU R128 loudness normalization with ffmpeg-normalize
+    full = "full"
+    # Single-pass dynamic peak normalization
+    fast = "fast"
+    # Only decoding and conversion
+    none = "none"
+
+AUDIO_FILE_EXTENSIONS = ('.aac', '.wav', '.mp3', '.wma', '.ogg', '.flac', '.opus')
+
+# Long recordings are split into overlapping segments, fingerprinted in parallel
+SEGMENT_MIN_DURATION = 6 * 60
+SEGMENT_LENGTH = 2 * 60
+SEGMENT_OVERLAP = 20
+
+# Seconds, hung ffmpeg or fingerprinting backend is killed after them
+PREPROCESSING_TIMEOUT = 5 * 60
+FINGERPRINT_TIMEOUT = 30 * 60
+MATCH_TIMEOUT = 2 * 60
+
+# Limits of ZIP archives of the bulk upload, a small archive may unpack into a lot of data
+ZIP_MAX_FILE_SIZE = 100 * 1024 * 1024
+ZIP_MAX_TOTAL_SIZE = 1024 * 1024 * 1024
@@ -12,6 +12,14 @@ class SQLighter:
             self.cursor.execute("CREATE TABLE if not exists users(user_id INTEGER NOT NULL PRIMARY KEY, user_name TEXT NOT NULL)")
             self.cursor.execute("CREATE TABLE if not exists folders(folder_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, folder_name TEXT NOT NULL, user_id INTEGER NOT NULL, FOREIGN KEY (user_id) REFERENCES users(user_id))")
             self.cursor.execute("CREATE TABLE if not exists audio_samples(audio_sample_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, audio_sample_name TEXT NOT NULL, folder_id INTEGER NOT NULL, file_unique_id TEXT NOT NULL,FOREIGN KEY(folder_id) REFERENCES folders(folder_id))")
+            # Added after release, NULL for samples uploaded before:
+            # archive_digest - original audio sample in the archive, job_id - upload job which registered the sample,
+            # duration - length of the processed audio sample in seconds
+            columns = [x[1] for x in self.cursor.execute("PRAGMA table_info(audio_samples)").fetchall()]
+            for column, column_type in [("archive_digest", "TEXT"), ("job_id", "INTEGER"), ("duration", "REAL")]:
+                if column not in columns:
+                    self.cursor.execute(f"ALTER TABLE audio_samples ADD COLUMN {column} {column_type}")
+            self.cursor.execute("CREATE TABLE if not exists audio_sample_segments(segment_name TEXT NOT NULL, segment_offset REAL NOT NULL, audio_sample_name TEXT NOT NULL, folder_id INTEGER NOT NULL, FOREIGN KEY(folder_id) REFERENCES folders(folder_id))")
 
     def select_user(self, user_id):
         with self.connection:
@@ -31,6 +39,10 @@ class SQLighter:
             result = self.cursor.execute("SELECT * FROM audio_samples WHERE folder_id= :0", {'0': folder_id}).fetchall()
             return result
 
+    def select_folders(self):
+        with self.connection:
+            return self.cursor.execute("SELECT * FROM folders ORDER BY folder_id").fetchall()
+
     def select_folder(self, folder_id):
         with self.connection:
             return self.cursor.execute("SELECT * FROM folders WHERE folder_id= :0", {'0': folder_id}).fetchone()
@@ -47,10 +59,48 @@ class SQLighter:
         # TODO
         pass
 
-    def register_audio_sample(self, folder_id, audio_sample_name, file_id) -> None:
+    def register_audio_sample(self, folder_id, audio_sample_name, file_id, archive_digest=None, job_id=None, duration=None) -> None:
+        with self.connection:
+            self.cursor.execute("INSERT INTO audio_samples (audio_sample_name, folder_id, file_unique_id, archive_digest, job_id, duration) VALUES (:0, :1, :2, :3, :4, :5)", {'0': audio_sample_name, '1': folder_id, '2': file_id, '3': archive_digest, '4': job_id, '5': duration})
+
+    def update_audio_sample_duration(self, folder_id, audio_sample_name, duration) -> None:
+        with self.connection:
+            self.cursor.execute("UPDATE audio_samples SET duration= :0 WHERE audio_sample_name= :1 AND folder_id= :2", {'0': duration, '1': audio_sample_name, '2': folder_id})
+
+    def select_job_audio_samples(self, folder_id, job_id) -> list:
+        """Names of the audio samples registered by the upload job"""
+        with self.connection:
+            return [x[0] for x in self.cursor.execute("SELECT audio_sample_name FROM audio_samples WHERE folder_id= :0 AND job_id= :1", {'0': folder_id, '1': job_id}).fetchall()]
+
+    def unregister_job_audio_samples(self, folder_id, job_id) -> None:
+        """Removes the audio samples registered by the interrupted upload job"""
+        with self.connection:
+            self.cursor.execute("DELETE FROM audio_sample_segments WHERE folder_id= :0 AND audio_sample_name IN (SELECT audio_sample_name FROM audio_samples WHERE folder_id= :0 AND job_id= :1)", {'0': folder_id, '1': job_id})
+            self.cursor.execute("DELETE FROM audio_samples WHERE folder_id= :0 AND job_id= :1", {'0': folder_id, '1': job_id})
+
+    def select_archive_digests(self) -> set:
+        with self.connection:
+            return {x[0] for x in self.cursor.execute("SELECT DISTINCT archive_digest FROM audio_samples WHERE archive_digest IS NOT NULL").fetchall()}
+
+    def register_audio_sample_segments(self, folder_id, audio_sample_name, segments) -> None:
+        """segments - list of (segment_name, segment_offset)"""
+        with self.connection:
+            self.cursor.executemany("INSERT INTO audio_sample_segments (segment_name, segment_offset, audio_sample_name, folder_id) VALUES (:0, :1, :2, :3)", [{'0': segment_name, '1': segment_offset, '2': audio_sample_name, '3': folder_id} for segment_name, segment_offset in segments])
+
+    def select_audio_sample_segments(self, folder_id, audio_sample_name):
+        with self.connection:
+            return self.cursor.execute("SELECT segment_name, segment_offset FROM audio_sample_segments WHERE audio_sample_name= :0 AND folder_id= :1 ORDER BY segment_offset", {'0': audio_sample_name, '1': folder_id}).fetchall()
+
+    def select_audio_sample_segment(self, folder_id, segment_name):
+        """(audio_sample_name, segment_offset, duration of the audio sample)"""
+        with self.connection:
+            return self.cursor.execute("SELECT audio_sample_segments.audio_sample_name, segment_offset, duration FROM audio_sample_segments LEFT JOIN audio_samples ON audio_samples.audio_sample_name = audio_sample_segments.audio_sample_name AND audio_samples.folder_id = audio_sample_segments.folder_id WHERE segment_name= :0 AND audio_sample_segments.folder_id= :1", {'0': segment_name, '1': folder_id}).fetchone()
+
+    def delete_audio_sample_segments(self, folder_id, audio_sample_name) -> None:
         with self.connection:
-            self.cursor.execute("INSERT INTO audio_samples (audio_sample_name, folder_id, file_unique_id) VALUES (:0, :1, :2)", {'0': audio_sample_name, '1': folder_id, '2': file_id})
+            self.cursor.execute("DELETE FROM audio_sample_segments WHERE audio_sample_name= :0 AND folder_id= :1", {'0': audio_sample_name, '1': folder_id})
 
     def unregister_audio_sample(self, folder_id, sample_name) -> None:
         with self.connection:
+            self.cursor.execute("DELETE FROM audio_sample_segments WHERE audio_sample_name= :0 AND folder_id= :1", {'0': sample_name, '1': folder_id})
             self.cursor.execute("DELETE FROM audio_samples WHERE audio_sample_name= :0 AND folder_id= :1", {'0': sample_name, '1': folder_id})
@@ -0,0 +1,90 @@
+"""Command line builders of the audio fingerprinting backends."""
+
+import os
+import sys
+
+from bot.constants import AudioLibrariesEnum, AudfprintModeEnum
+
+AUDFPRINT_PATH = 'bot/library/audfprint/audfprint.py'
+SOUNDFINGERPRINTING_PATH = 'bot/library/SoundFingerprinting/SoundFingerprinting.AddictedCS.Demo'
+# audfprint looks up the removed file with list.index, missing file fails with its ValueError
+AUDFPRINT_MISSING_TRACK_ERROR = "is not in list"
+AUDFPRINT_PRECOMPUTED_EXTENSION = '.afpt'
+AUDFPRINT_ACCURATE_ANALYSIS = ['-n', '120', '-X', '-F', '0']
+# Time of the query start in the matched file in seconds, printed next to RESULT
+MATCH_TIME_KEY = "TIME"
+
+
+def precompute_cmd(audio_library, audfprint_mode, input_files: list, ncores: int = 1) -> list:
+    """
+    Returns command which analyzes input files once on `ncores` processes and writes
+    `hashes_file` of every input file, duplicate check and registration read them
+    instead of the audio. None if the backend can only analyze the audio itself.
+    """
+    if audio_library == AudioLibrariesEnum.audfprint.value:
+        # Empty precompute directory keeps the hashes file next to the input file
+        cmd = [sys.executable, AUDFPRINT_PATH, 'precompute', '-p', '', *input_files]
+        if audfprint_mode == AudfprintModeEnum.accurate.value:
+            cmd += AUDFPRINT_ACCURATE_ANALYSIS
+        if ncores > 1:
+            cmd += ['-H', str(ncores)]
+        return cmd
+    return None
+
+
+def hashes_file(audio_library, input_file) -> str:
+    """File which is given to the backend instead of the audio file, backend stores the track under its name"""
+    if audio_library == AudioLibrariesEnum.audfprint.value:
+        return os.path.splitext(input_file)[0] + AUDFPRINT_PRECOMPUTED_EXTENSION
+    return input_file
+
+
+def add_hashes_cmds(audio_library, audfprint_mode, fingerprint_db, input_files: list, ncores: int = 1) -> list:
+    """
+    Returns commands which add all input files to the fingerprint database.
+
+    audfprint analyzes all files with one invocation on `ncores` processes and writes
+    database only once, SoundFingerprinting gets one invocation per file.
+    """
+    if audio_library == AudioLibrariesEnum.audfprint.value:
+        db_hashes_add_method = 'add' if os.path.exists(fingerprint_db) else 'new'
+        cmd = [sys.executable, AUDFPRINT_PATH, db_hashes_add_method, '-d', fingerprint_db, *input_files]
+        if audfprint_mode == AudfprintModeEnum.accurate.value:
+            cmd += AUDFPRINT_ACCURATE_ANALYSIS
+        if ncores > 1:
+            cmd += ['-H', str(ncores)]
+        return [cmd]
+    elif audio_library == AudioLibrariesEnum.SoundFingerprinting.value:
+        return [[SOUNDFINGERPRINTING_PATH, 'add', fingerprint_db, input_file] for input_file in input_files]
+
+
+def match_cmd(audio_library, audfprint_mode, fingerprint_db, input_file, min_count: int = None) -> list:
+    """min_count - matching landmarks required for a match, SoundFingerprinting uses its own threshold"""
+    if audio_library == AudioLibrariesEnum.audfprint.value:
+        cmd = [sys.executable, AUDFPRINT_PATH, 'match', '-d', fingerprint_db, input_file]
+        if audfprint_mode == AudfprintModeEnum.accurate.value:
+            cmd += ['-n', '120', '-D', '2000', '-X', '-F', '18']
+        if min_count:
+            cmd += ['--min-count', str(min_count)]
+        return cmd
+    elif audio_library == AudioLibrariesEnum.SoundFingerprinting.value:
+        return [SOUNDFINGERPRINTING_PATH, 'match', fingerprint_db, input_file]
+
+
+def remove_hashes_cmds(audio_library, fingerprint_db, sample_names: list) -> list:
+    if audio_library == AudioLibrariesEnum.audfprint.value:
+        return [[sys.executable, AUDFPRINT_PATH, 'remove', '-d', fingerprint_db, *sample_names, '-H', '2']]
+    elif audio_library == AudioLibrariesEnum.SoundFingerprinting.value:
+        return [[SOUNDFINGERPRINTING_PATH, 'remove', fingerprint_db, sample_name] for sample_name in sample_names]
+
+
+def command_processes(cmd: list) -> int:
+    """Processes the command runs at the same time, audfprint forks `-H` workers"""
+    return int(cmd[cmd.index('-H') + 1]) if '-H' in cmd else 1
+
+
+def is_missing_track_error(audio_library, stderr: str) -> bool:
+    """Remove command failed because the file is not in the database"""
+    if audio_library == AudioLibrariesEnum.audfprint.value:
+        return AUDFPRINT_MISSING_TRACK_ERROR in stderr
+    return False
@@ -0,0 +1,109 @@
+"""Durable job queue in SQLite, shared by the bot and worker processes."""
+
+import json
+import time
+import sqlite3
+import threading
+
+from dataclasses import dataclass
+
+
+@dataclass
+class Job:
+    job_id: int
+    kind: str
+    chat_id: int
+    stage: int
+    payload: dict
+    attempts: int
+    worker_id: str
+    created_at: float
+
+
+class JobStore:
+    """
+    Jobs are leased by workers for a limited time and the lease is prolonged
+    while job is running. Job of the crashed worker becomes available again
+    after its lease expires and continues from the last saved stage. Only one
+    job of the same chat changes its folders at a time, read-only jobs run
+    alongside them - folder locks keep them consistent.
+
+    Writes may wait for the lock of the job table, so the bot calls them
+    through `asyncio.to_thread`. Every thread has its own connection.
+    """
+
+    def __init__(self, database, read_only_kinds=()):
+        self.database = database
+        self.read_only_kinds = tuple(read_only_kinds)
+        self._local = threading.local()
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.database, timeout=30)
+            # Readers and writers of other processes don't block each other. WAL needs shared memory,
+            # so all processes must run on the same host, the database can't be on a network filesystem
+            connection.execute("PRAGMA journal_mode = WAL")
+            self._local.connection = connection
+        return connection
+
+    def init(self):
+        with self.connection:
+            self.connection.execute("CREATE TABLE if not exists jobs(job_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL, kind TEXT NOT NULL, chat_id INTEGER NOT NULL, stage INTEGER NOT NULL DEFAULT 0, payload TEXT NOT NULL, status TEXT NOT NULL DEFAULT 'queued', attempts INTEGER NOT NULL DEFAULT 0, worker_id TEXT, lease_expires REAL, error TEXT, created_at REAL NOT NULL, started_at REAL, updated_at REAL NOT NULL)")
+            self.connection.execute("CREATE INDEX if not exists jobs_status ON jobs(status, job_id)")
+
+    def enqueue(self, kind, chat_id, payload: dict) -> int:
+        now = time.time()
+        with self.connection:
+            return self.connection.execute("INSERT INTO jobs (kind, chat_id, payload, created_at, updated_at) VALUES (:0, :1, :2, :3, :3)", {'0': kind, '1': chat_id, '2': json.dumps(payload), '3': now}).lastrowid
+
+    def lease(self, worker_id, lease_seconds: float, max_attempts: int):
+        """Takes the oldest available job, returns None if there is nothing to do"""
+        now = time.time()
+        with self.connection:
+            # Take the write lock before looking for a job, so that two workers never lease the same one
+            self.connection.execute("BEGIN IMMEDIATE")
+            self.connection.execute("UPDATE jobs SET status = 'failed', error = 'Too many attempts', updated_at = :0 WHERE status = 'running' AND lease_expires < :0 AND attempts >= :1", {'0': now, '1': max_attempts})
+            read_only_kinds = ", ".join(f":kind{num}" for num in range(len(self.read_only_kinds)))
+            row = self.connection.execute(
+                "SELECT job_id FROM jobs WHERE (status = 'queued' OR (status = 'running' AND lease_expires < :0)) "
+                f"AND (kind IN ({read_only_kinds}) OR chat_id NOT IN (SELECT chat_id FROM jobs WHERE status = 'running' AND lease_expires >= :0 AND kind NOT IN ({read_only_kinds}))) "
+                "ORDER BY job_id LIMIT 1", {'0': now, **{f"kind{num}": kind for num, kind in enumerate(self.read_only_kinds)}}
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute("UPDATE jobs SET status = 'running', worker_id = :0, lease_expires = :1, attempts = attempts + 1, started_at = coalesce(started_at, :2), updated_at = :2 WHERE job_id = :3", {'0': worker_id, '1': now + lease_seconds, '2': now, '3': row[0]})
+            return self.select_job(row[0])
+
+    def select_job(self, job_id):
+        row = self.connection.execute("SELECT job_id, kind, chat_id, stage, payload, attempts, worker_id, created_at FROM jobs WHERE job_id = :0", {'0': job_id}).fetchone()
+        if row is None:
+            return None
+        job_id, kind, chat_id, stage, payload, attempts, worker_id, created_at = row
+        return Job(job_id, kind, chat_id, stage, json.loads(payload), attempts, worker_id, created_at)
+
+    def heartbeat(self, job: Job, lease_seconds: float) -> bool:
+        """Prolongs lease of the job, returns False if the job was leased by another worker"""
+        now = time.time()
+        with self.connection:
+            return self.connection.execute("UPDATE jobs SET lease_expires = :0, updated_at = :1 WHERE job_id = :2 AND worker_id = :3 AND status = 'running'", {'0': now + lease_seconds, '1': now, '2': job.job_id, '3': job.worker_id}).rowcount == 1
+
+    def checkpoint(self, job: Job) -> None:
+        """Saves stage and payload of the job, the job continues from here after restart"""
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET stage = :0, payload = :1, updated_at = :2 WHERE job_id = :3 AND worker_id = :4", {'0': job.stage, '1': json.dumps(job.payload), '2': time.time(), '3': job.job_id, '4': job.worker_id})
+
+    def finish(self, job: Job, status='done', error=None) -> None:
+        """Worker which lost the lease of the job doesn't change its status"""
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET status = :0, error = :1, lease_expires = NULL, updated_at = :2 WHERE job_id = :3 AND worker_id = :4", {'0': status, '1': error, '2': time.time(), '3': job.job_id, '4': job.worker_id})
+
+    def release(self, worker_id) -> None:
+        """Returns running jobs of the stopped worker back to the queue"""
+        with self.connection:
+            self.connection.execute("UPDATE jobs SET status = 'queued', attempts = max(attempts - 1, 0), worker_id = NULL, lease_expires = NULL, updated_at = :0 WHERE worker_id = :1 AND status = 'running'", {'0': time.time(), '1': worker_id})
+
+    def count_jobs(self, status) -> int:
+        with self.connection:
+            return self.connection.execute("SELECT count(*) FROM jobs WHERE status = :0", {'0': status}).fetchone()[0]
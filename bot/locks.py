@@ -0,0 +1,112 @@
+"""Per-folder reader-writer coordination of fingerprint databases."""
+
+import os
+import fcntl
+import shutil
+import asyncio
+import weakref
+
+from contextlib import suppress, asynccontextmanager
+
+_folder_locks = weakref.WeakValueDictionary()
+
+
+class FolderLock:
+    """
+    Reader-writer lock of one folder fingerprint database.
+
+    Writers are exclusive, also between bot and worker processes which share
+    the database file: each of them works with a private copy of the
+    database and publishes it with an atomic `os.replace`. Readers never wait
+    for writers - they keep using the last published snapshot, an already
+    opened database file stays intact after being replaced.
+    """
+
+    def __init__(self, fingerprint_db: str):
+        self.fingerprint_db = fingerprint_db
+        self.readers = 0
+        self._writer = asyncio.Lock()
+
+    @property
+    def writing(self) -> bool:
+        return self._writer.locked()
+
+    @asynccontextmanager
+    async def read(self):
+        """Yields path to the published snapshot of the database"""
+        self.readers += 1
+        try:
+            yield self.fingerprint_db
+        finally:
+            self.readers -= 1
+
+    @asynccontextmanager
+    async def _process_lock(self):
+        """Advisory lock of the database between processes, polled to keep event loop free"""
+        with open(f"{self.fingerprint_db}.lock", "a") as lock_file:
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    await asyncio.sleep(0.1)
+                else:
+                    break
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @asynccontextmanager
+    async def write(self):
+        """
+        Yields path to the working copy of the database.
+
+        The working copy does not exist if the database was not created yet.
+        On success the working copy becomes the new version of the database,
+        removed working copy removes the database. On error nothing is
+        published.
+        """
+        async with self._writer, self._process_lock():
+            working_copy = f"{self.fingerprint_db}.tmp"
+            with suppress(FileNotFoundError):
+                os.remove(working_copy)
+            if os.path.exists(self.fingerprint_db):
+                await asyncio.to_thread(shutil.copy2, self.fingerprint_db, working_copy)
+
+            try:
+                yield working_copy
+            except BaseException:
+                with suppress(FileNotFoundError):
+                    os.remove(working_copy)
+                raise
+
+            if os.path.exists(working_copy):
+                os.replace(working_copy, self.fingerprint_db)
+            else:
+                with suppress(FileNotFoundError):
+                    os.remove(self.fingerprint_db)
+
+
+def file_version(file_path):
+    """
+    [inode, mtime] of the file, None if it doesn't exist. `os.replace` keeps
+    both, the published database has the version of its working copy.
+    """
+    with suppress(FileNotFoundError):
+        stat = os.stat(file_path)
+        return [stat.st_ino, stat.st_mtime_ns]
+    return None
+
+
+def folder_lock(fingerprint_db: str) -> FolderLock:
+    """Returns the lock of the folder fingerprint database, shared by all tasks of the process"""
+    lock = _folder_locks.get(fingerprint_db)
+    if lock is None:
+        lock = FolderLock(fingerprint_db)
+        _folder_locks[fingerprint_db] = lock
+    return lock
+
+
+def active_folder_locks() -> list:
+    """Locks of the folders which are being read or written by this process"""
+    return [lock for lock in list(_folder_locks.values()) if lock.readers or lock.writing]
@@ -0,0 +1,195 @@
+"""
+Latency instrumentation of the bot in the Prometheus text format.
+
+Metrics are kept in the process and served by a small aiohttp endpoint
+(aiohttp comes with aiogram). Every observation is also logged with loguru,
+the `metric` field and labels are in `extra`, so serialized logs can be
+analysed without the metrics server.
+"""
+
+import os
+import sys
+import time
+import functools
+
+from aiohttp import web
+from aiogram import Bot
+from loguru import logger
+
+# Seconds, from a fast SQLite query to a long fingerprinting run
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+_registry = []
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels) -> None:
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """Value is either set directly or computed by `function` on every scrape"""
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, **labels) -> None:
+        self._values[self._key(labels)] = value
+
+    def collect(self) -> list:
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception as ex:
+                logger.warning(f"Can't collect {self.name}: {ex!r}")
+            else:
+                # Function returns either a value or {label values: value}
+                self._values = value if isinstance(value, dict) else {(): value}
+        return super().collect()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS, log_level="DEBUG"):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self.log_level = log_level
+
+    def observe(self, value, **labels) -> None:
+        key = self._key(labels)
+        # Bucket counts are cumulative, as in the exposition format
+        counts, count, total = self._values.get(key, ([0] * len(self.buckets), 0, 0.0))
+        for num, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                counts[num] += 1
+        self._values[key] = (counts, count + 1, total + value)
+        logger.bind(metric=self.name, value=value, **labels).log(self.log_level, f"{self.name}{_format_labels(self.labelnames, key)} {value:.4f}")
+
+    def collect(self) -> list:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, (counts, count, total) in sorted(self._values.items()):
+            for bucket, bucket_count in zip(self.buckets, counts):
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', bucket)])} {bucket_count}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, [('le', '+Inf')])} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+def render() -> str:
+    return "\n".join(line for metric in _registry for line in metric.collect()) + "\n"
+
+
+STAGE_SECONDS = Histogram("stravinsky_stage_seconds", "Duration of job stages", ["stage"])
+STAGE_ERRORS = Counter("stravinsky_stage_errors_total", "Failed job stages", ["stage"])
+QUEUE_WAIT_SECONDS = Histogram("stravinsky_job_queue_wait_seconds", "Time from enqueueing of the job to its first start", ["kind"])
+JOB_SECONDS = Histogram("stravinsky_job_seconds", "Duration of the job run by a worker", ["kind"])
+JOBS = Counter("stravinsky_jobs_total", "Jobs run by workers of this process", ["kind", "status"])
+MATCH_RESULTS = Counter("stravinsky_match_results_total", "Results of voice queries, result is match, nomatch or error (backend printed no result)", ["result"])
+DATABASE_SECONDS = Histogram("stravinsky_database_seconds", "Duration of SQLite calls", ["database", "method"], log_level="TRACE")
+TELEGRAM_SECONDS = Histogram("stravinsky_telegram_seconds", "Duration of Bot API calls", ["method"], log_level="TRACE")
+TELEGRAM_ERRORS = Counter("stravinsky_telegram_errors_total", "Failed Bot API calls", ["method"])
+COMMAND_SECONDS = Histogram("stravinsky_command_seconds", "Duration of external commands", ["command"])
+COMMAND_WAIT_SECONDS = Histogram("stravinsky_command_wait_seconds", "Time external commands waited for a free process slot", ["command"])
+COMMAND_ERRORS = Counter("stravinsky_command_errors_total", "Failed and killed external commands", ["command"])
+
+
+def command_name(cmd: list) -> str:
+    """Label of the command: executable, or script for Python backends"""
+    return os.path.basename(cmd[1] if cmd[0] == sys.executable and len(cmd) > 1 else cmd[0])
+
+
+def measure_stage(stage):
+    """Decorator of the async stage function, errors are the exceptions raised by it"""
+    def decorator(function):
+        @functools.wraps(function)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await function(*args, **kwargs)
+            except Exception:
+                STAGE_ERRORS.inc(stage=stage)
+                raise
+            finally:
+                STAGE_SECONDS.observe(time.perf_counter() - started, stage=stage)
+        return wrapper
+    return decorator
+
+
+def measure_methods(instance, database) -> None:
+    """Wraps public methods of the database wrapper instance (SQLighter, JobStore) with timing"""
+    def measured(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                DATABASE_SECONDS.observe(time.perf_counter() - started, database=database, method=method.__name__)
+        return wrapper
+
+    for name in dir(type(instance)):
+        if not name.startswith("_") and callable(getattr(type(instance), name)):
+            setattr(instance, name, measured(getattr(instance, name)))
+
+
+class MeasuredBot(Bot):
+    """Bot which measures every Bot API request"""
+
+    async def request(self, method, data=None, files=None, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await super().request(method, data, files, **kwargs)
+        except Exception:
+            TELEGRAM_ERRORS.inc(method=method)
+            raise
+        finally:
+            TELEGRAM_SECONDS.observe(time.perf_counter() - started, method=method)
+
+
+async def handle_metrics(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8", headers={"X-Content-Type-Options": "nosniff"})
+
+
+async def start_metrics_server(host, port) -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Metrics are served on http://{host}:{port}/metrics")
+    return runner
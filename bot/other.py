@@ -1,9 +1,11 @@
+import os
 import string
 import random
-import asyncio
-from loguru import logger
+import zipfile
 from dataclasses import dataclass
 
+from bot.constants import AUDIO_FILE_EXTENSIONS
+
 USER_DATA_PATH = "bot/user_data/data"
 
 # https://pynative.com/python-generate-random-string/
@@ -13,19 +15,43 @@ def generate_random_string(length: int) -> str:
     return ''.join(random.choice(letters) for i in range(length))
 
 
-async def execute_command(cmd: list):
-        proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-        stdout, stderr = await proc.communicate()
-        logger.debug(f'[{cmd!r} exited with {proc.returncode}]')
-        logger.debug(f'[stdout]\n{stdout.decode()}')
-        logger.debug(f'[stderr]\n{stderr.decode()}')
-        assert proc.returncode == 0
-        return proc
+def format_timestamp(seconds: float) -> str:
+    """Returns timestamp in MM:SS format"""
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes:02d}:{seconds:02d}"
+
+
+def extract_audio_files(zip_file: str, destination: str, max_file_size: int, max_total_size: int, max_files: int) -> list:
+    """
+    Extracts audio files from ZIP archive into flat directory, returns paths of extracted files.
+    Only first `max_files` audio files are extracted, archive which unpacks into more than
+    `max_total_size` bytes is rejected before extraction.
+    """
+    with zipfile.ZipFile(zip_file) as archive:
+        members = {}
+        for member in archive.infolist():
+            file_name = os.path.basename(member.filename)
+            if member.is_dir() or member.file_size > max_file_size or file_name.startswith('.'):
+                continue
+            if os.path.splitext(file_name)[1].lower() not in AUDIO_FILE_EXTENSIONS or file_name in members:
+                continue
+            members[file_name] = member
+            if len(members) >= max_files:
+                break
+
+        # zipfile never reads more than the size declared in the member header
+        if sum(member.file_size for member in members.values()) > max_total_size:
+            raise ValueError(f"ZIP archive unpacks into more than {max_total_size} bytes")
 
+        extracted_files = []
+        for file_name, member in members.items():
+            extracted_file = os.path.join(destination, file_name)
+            with archive.open(member) as source, open(extracted_file, 'wb') as target:
+                while chunk := source.read(1024 * 1024):
+                    target.write(chunk)
+            extracted_files.append(extracted_file)
+    return extracted_files
 
-async def process_output_lines(process):
-  async for line in process.stdout:
-    yield line.rstrip().decode()
 
 @dataclass
 class PATH:
@@ -0,0 +1,236 @@
+"""
+On-demand profiling of jobs in production.
+
+The sampler thread looks at the event loop thread every few milliseconds.
+Samples of a profiled job are its Python stack if the job is running on the
+loop (CPU, blocking SQLite calls) or its chain of awaits if it is suspended,
+ending with the external command it waits for (ffmpeg, fingerprinting
+backends). Stacks of other code which keeps the loop busy are collected
+separately. Profiles are written in the collapsed stack format, loadable by
+speedscope and flamegraph.pl, one file per job.
+
+Memory snapshots are written with `tracemalloc.Snapshot.dump` and can be
+loaded with `tracemalloc.Snapshot.load`. Allocations are traced only between
+`start_memory_tracing` and `stop_memory_tracing`.
+"""
+
+import os
+import sys
+import time
+import asyncio
+import resource
+import tempfile
+import threading
+import tracemalloc
+
+from loguru import logger
+from contextlib import contextmanager
+
+from bot.metrics import Histogram
+from bot.supervisor import task_command
+
+PROFILES_PATH = "bot/user_data/profiles"
+SAMPLE_INTERVAL = 0.005
+LAG_CHECK_INTERVAL = 0.5
+LAG_WARNING = 1
+
+EVENT_LOOP_LAG_SECONDS = Histogram("stravinsky_event_loop_lag_seconds", "Delay of event loop callbacks", buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10), log_level="TRACE")
+
+
+def _frame_label(frame) -> str:
+    return f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)})"
+
+
+def _thread_stack(frame) -> list:
+    """Frames of the thread, outermost first"""
+    stack = []
+    while frame is not None:
+        stack.append(_frame_label(frame))
+        frame = frame.f_back
+    return stack[::-1]
+
+
+def _await_stack(coro) -> list:
+    """Frames of the suspended coroutine and everything it awaits, outermost first"""
+    stack = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is not None:
+            stack.append(_frame_label(frame))
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+    return stack
+
+
+def _is_idle(frame) -> bool:
+    """Loop thread waits for events in the selector"""
+    return frame.f_code.co_name == "select" and frame.f_code.co_filename.endswith("selectors.py")
+
+
+class _ProfilingSession:
+    """State of one sampler thread, a finishing thread never touches the next session"""
+
+    def __init__(self, path, loop):
+        self.path = path
+        self.loop = loop
+        self.loop_thread_id = threading.get_ident()
+        self.jobs = {}
+        self.loop_stacks = {}
+
+
+class JobProfiler:
+    def __init__(self):
+        self.remaining = 0
+        self.session_path = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    def start(self, jobs_count: int) -> str:
+        """Profiles next `jobs_count` jobs, must be called from the event loop. Returns directory of profiles"""
+        with self._lock:
+            self.remaining = jobs_count
+            if self._session is None:
+                os.makedirs(PROFILES_PATH, exist_ok=True)
+                # Sessions started within one second get separate directories
+                self.session_path = tempfile.mkdtemp(prefix=time.strftime("%Y-%m-%d_%H-%M-%S_"), dir=PROFILES_PATH)
+                self._session = _ProfilingSession(self.session_path, asyncio.get_running_loop())
+                threading.Thread(target=self._sample, args=(self._session,), name="profiler", daemon=True).start()
+            session_path = self._session.path
+        logger.info(f"Profiling next {jobs_count} jobs into {session_path}")
+        return session_path
+
+    def stop(self) -> None:
+        """Jobs which are being profiled finish their profiles"""
+        self.remaining = 0
+
+    @contextmanager
+    def profile_job(self, job):
+        task = asyncio.current_task()
+        with self._lock:
+            session = self._session
+            profiled = self.remaining > 0 and session is not None
+            if profiled:
+                self.remaining -= 1
+                stacks = session.jobs[task] = {}
+        if not profiled:
+            yield
+            return
+
+        try:
+            yield
+        finally:
+            with self._lock:
+                del session.jobs[task]
+            profile_file = os.path.join(session.path, f"job_{job.job_id}_{job.kind}.collapsed")
+            self._write(profile_file, stacks)
+            logger.info(f"Profile of job {job.job_id} is saved to {profile_file}")
+
+    def _sample(self, session: _ProfilingSession):
+        while True:
+            with self._lock:
+                if self.remaining <= 0 and not session.jobs:
+                    # Next `start` begins a new session
+                    self._session = None
+                    break
+            time.sleep(SAMPLE_INTERVAL)
+            frame = sys._current_frames().get(session.loop_thread_id)
+            if frame is None:
+                continue
+            loop_stack = None if _is_idle(frame) else _thread_stack(frame)
+            running_task = asyncio.current_task(session.loop)
+
+            with self._lock:
+                for task, stacks in session.jobs.items():
+                    try:
+                        if task is running_task and loop_stack is not None:
+                            stack = ["running", *loop_stack]
+                        else:
+                            stack = ["waiting", *_await_stack(task.get_coro())]
+                            if (command := task_command(task)) is not None:
+                                stack.append(f"[{command}]")
+                    except Exception:
+                        # Coroutine changed under the sampler
+                        continue
+                    key = ";".join(stack)
+                    stacks[key] = stacks.get(key, 0) + 1
+
+                if loop_stack is not None and running_task not in session.jobs:
+                    key = ";".join(loop_stack)
+                    session.loop_stacks[key] = session.loop_stacks.get(key, 0) + 1
+
+        self._write(os.path.join(session.path, "event_loop.collapsed"), session.loop_stacks)
+
+    @staticmethod
+    def _write(profile_file, stacks: dict) -> None:
+        with open(profile_file, "w") as file:
+            for stack, count in sorted(stacks.items()):
+                file.write(f"{stack} {count}\n")
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop runs a callback scheduled `LAG_CHECK_INTERVAL` ahead"""
+
+    def __init__(self):
+        self.last_lag = 0
+        self.max_lag = 0
+        self._task = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + LAG_CHECK_INTERVAL
+            await asyncio.sleep(LAG_CHECK_INTERVAL)
+            self.last_lag = max(loop.time() - scheduled, 0)
+            self.max_lag = max(self.max_lag, self.last_lag)
+            EVENT_LOOP_LAG_SECONDS.observe(self.last_lag)
+            if self.last_lag > LAG_WARNING:
+                logger.warning(f"Event loop was blocked for {self.last_lag:.2f}s")
+
+
+def start_memory_tracing(frames: int = 25) -> None:
+    """Snapshots show only allocations made after this call, tracing slows allocations down"""
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(frames)
+        logger.info("Started tracing of memory allocations")
+
+
+def stop_memory_tracing() -> None:
+    if tracemalloc.is_tracing():
+        tracemalloc.stop()
+        logger.info("Stopped tracing of memory allocations")
+
+
+def memory_snapshot(top: int = 10) -> tuple:
+    """
+    Dumps tracemalloc snapshot, tracing must be started with `start_memory_tracing`.
+    Returns (snapshot file, report text).
+    """
+    if not tracemalloc.is_tracing():
+        raise RuntimeError("Memory allocations are not traced")
+
+    os.makedirs(PROFILES_PATH, exist_ok=True)
+    snapshot_file = os.path.join(PROFILES_PATH, f"memory_{time.strftime('%Y-%m-%d_%H-%M-%S')}.tracemalloc")
+    snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+    snapshot.dump(snapshot_file)
+
+    traced, peak = tracemalloc.get_traced_memory()
+    # ru_maxrss is in kilobytes on Linux
+    lines = [
+        f"Python allocations: {traced / 2 ** 20:.1f} MB, peak {peak / 2 ** 20:.1f} MB",
+        f"Peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10:.1f} MB",
+        f"Peak RSS of external commands: {resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 2 ** 10:.1f} MB",
+        "",
+    ]
+    for stat in snapshot.statistics("lineno")[:top]:
+        lines.append(f"{stat.size / 2 ** 10:.0f} KB in {stat.count} blocks: {stat.traceback[0]}")
+    return snapshot_file, "\n".join(lines)
+
+
+profiler = JobProfiler()
+loop_lag_monitor = LoopLagMonitor()
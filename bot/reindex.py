@@ -0,0 +1,182 @@
+"""
+Offline rebuild of the folder fingerprint databases from the archive of the
+original audio samples, e.g. after changing AUDIO_LIBRARY, AUDFPRINT_MODE,
+AUDIO_PREPROCESSING or hashing parameters. Set new settings in .env first.
+
+Every folder is rebuilt in a temporary directory while its database is
+locked for writing: uploads to this folder wait, queries keep using the old
+version until the new one is swapped in atomically. Rebuilt folders are saved
+to the state file, interrupted reindex continues from where it stopped when
+started again with the same settings. Samples uploaded before the archive
+was introduced can't be rebuilt, folders with them are skipped.
+
+Usage:
+    python -m bot.reindex [--folders 2] [--folder-id ID ...] [--restart] [--prune-archive]
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import tempfile
+
+from loguru import logger
+from contextlib import suppress
+
+from bot.__main__ import db, AUDIO_LIBRARY, AUDFPRINT_MODE, AUDIO_PREPROCESSING
+from bot.locks import folder_lock
+from bot.archive import ARCHIVE_PATH, archive_file
+from bot.fingerprint import precompute_cmd, hashes_file, add_hashes_cmds, command_processes
+from bot.audio import probe_duration, split_audio, segment_name, preprocessing_cmd
+from bot.supervisor import execute_command, process_slots
+from bot.other import path, format_timestamp
+from bot.constants import PREPROCESSING_TIMEOUT, FINGERPRINT_TIMEOUT
+
+STATE_FILE = "bot/user_data/reindex_state.json"
+# Archived files younger than this may belong to uploads which are not registered yet
+PRUNE_MIN_AGE = 24 * 60 * 60
+
+
+class ReindexError(Exception):
+    pass
+
+
+def load_state(settings: dict) -> dict:
+    with suppress(FileNotFoundError):
+        with open(STATE_FILE) as file:
+            state = json.load(file)
+        if state["settings"] == settings:
+            return state
+        logger.warning("Settings changed since the last reindex, starting over")
+    return {"settings": settings, "done": []}
+
+
+def save_state(state: dict) -> None:
+    with open(STATE_FILE + ".tmp", "w") as file:
+        json.dump(state, file)
+    os.replace(STATE_FILE + ".tmp", STATE_FILE)
+
+
+async def rebuild_folder(folder, work_dir) -> int:
+    """Rebuilds fingerprint database of the folder, returns number of its audio samples"""
+    folder_id, folder_name, user_id = folder
+    path_list = path(user_id, folder_name)
+
+    async with folder_lock(path_list.fingerprint_db()).write() as fingerprint_db:
+        samples = db.select_folder_samples(folder_id)
+        if not samples:
+            with suppress(FileNotFoundError):
+                os.remove(fingerprint_db)
+            return 0
+
+        not_archived = [sample[1] for sample in samples if sample[4] is None or not os.path.exists(archive_file(sample[4]))]
+        if not_archived:
+            raise ReindexError(f"Audio samples are not archived: {', '.join(not_archived)}")
+
+        # Backends store tracks under the names of their hashes files: match reports them, removal of the
+        # sample looks them up, so they must be derived from the paths an upload of the sample uses
+        os.makedirs(path_list.processed_audio_samples(), exist_ok=True)
+        processed_files = [path_list.processed_audio_samples(sample[1] + ".mp3") for sample in samples]
+        segments = []
+        try:
+            await asyncio.gather(*(
+                execute_command(preprocessing_cmd(archive_file(sample[4]), processed_file, AUDIO_PREPROCESSING), timeout=PREPROCESSING_TIMEOUT)
+                for sample, processed_file in zip(samples, processed_files)
+            ))
+            durations = await asyncio.gather(*map(probe_duration, processed_files))
+            segments = await asyncio.gather(*(split_audio(processed_file, duration) for processed_file, duration in zip(processed_files, durations)))
+
+            segment_files = [segment_file for sample_segments in segments for segment_file, _ in sample_segments]
+            if (cmd := precompute_cmd(AUDIO_LIBRARY, AUDFPRINT_MODE, segment_files, ncores=process_slots())) is not None:
+                await execute_command(cmd, timeout=FINGERPRINT_TIMEOUT, processes=command_processes(cmd))
+
+            new_fingerprint_db = os.path.join(work_dir, os.path.basename(fingerprint_db))
+            for cmd in add_hashes_cmds(AUDIO_LIBRARY, AUDFPRINT_MODE, new_fingerprint_db, [hashes_file(AUDIO_LIBRARY, segment_file) for segment_file in segment_files]):
+                await execute_command(cmd, timeout=FINGERPRINT_TIMEOUT, processes=command_processes(cmd))
+
+            # Segments of the samples may change with the settings, queries see them together with the new database
+            for sample, sample_segments, duration in zip(samples, segments, durations):
+                # Samples registered before durations were stored get them here
+                db.update_audio_sample_duration(folder_id, sample[1], duration)
+                db.delete_audio_sample_segments(folder_id, sample[1])
+                if len(sample_segments) > 1:
+                    db.register_audio_sample_segments(folder_id, sample[1], [(segment_name(sample[1], segment_offset), segment_offset) for _, segment_offset in sample_segments])
+            # Working copy becomes the folder database when the lock is released
+            shutil.move(new_fingerprint_db, fingerprint_db)
+        finally:
+            segment_files = [segment_file for sample_segments in segments for segment_file, _ in sample_segments]
+            for tmp_file in set(processed_files + segment_files + [hashes_file(AUDIO_LIBRARY, segment_file) for segment_file in segment_files]):
+                with suppress(FileNotFoundError):
+                    os.remove(tmp_file)
+    return len(samples)
+
+
+def prune_archive() -> int:
+    """Removes archived audio of deleted samples, returns number of removed files"""
+    referenced = db.select_archive_digests()
+    removed = 0
+    for root, _, files in os.walk(ARCHIVE_PATH):
+        for file_name in files:
+            file_path = os.path.join(root, file_name)
+            digest = file_name.split(".")[0]
+            if digest not in referenced and time.time() - os.path.getmtime(file_path) > PRUNE_MIN_AGE:
+                os.remove(file_path)
+                removed += 1
+    return removed
+
+
+async def main(args) -> int:
+    settings = {"AUDIO_LIBRARY": AUDIO_LIBRARY, "AUDFPRINT_MODE": AUDFPRINT_MODE, "AUDIO_PREPROCESSING": AUDIO_PREPROCESSING}
+    state = {"settings": settings, "done": []} if args.restart else load_state(settings)
+
+    folders = [folder for folder in db.select_folders() if not args.folder_id or folder[0] in args.folder_id]
+    pending = [folder for folder in folders if folder[0] not in state["done"]]
+    logger.info(f"Reindexing {len(pending)} folders, {len(folders) - len(pending)} are already done")
+
+    semaphore = asyncio.Semaphore(args.folders)
+    failed = []
+    processed = 0
+    started = time.perf_counter()
+
+    async def reindex(folder):
+        nonlocal processed
+        async with semaphore:
+            folder_started = time.perf_counter()
+            try:
+                with tempfile.TemporaryDirectory(prefix="StravinskyBot_reindex_") as work_dir:
+                    samples_count = await rebuild_folder(folder, work_dir)
+            except Exception as ex:
+                failed.append(folder[0])
+                result = f"failed: {ex}"
+            else:
+                state["done"].append(folder[0])
+                save_state(state)
+                result = f"{samples_count} samples in {time.perf_counter() - folder_started:.1f}s"
+
+            processed += 1
+            eta = (time.perf_counter() - started) / processed * (len(pending) - processed)
+            logger.info(f"[{processed}/{len(pending)}] Folder {folder[0]} \"{folder[1]}\": {result}, ETA {format_timestamp(eta)}")
+
+    await asyncio.gather(*map(reindex, pending))
+
+    if args.prune_archive:
+        logger.info(f"Removed {prune_archive()} archived audio files of deleted samples")
+    if failed:
+        logger.error(f"Failed folders: {', '.join(map(str, failed))}. Fix them and run reindex again, done folders are skipped")
+        return 1
+    with suppress(FileNotFoundError):
+        os.remove(STATE_FILE)
+    logger.info("Reindex is finished")
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rebuild fingerprint databases of all folders from the audio samples archive")
+    parser.add_argument("--folders", type=int, default=2, help="folders rebuilt at the same time, every one uses all CPU cores for fingerprinting")
+    parser.add_argument("--folder-id", type=int, nargs="*", help="rebuild only these folders")
+    parser.add_argument("--restart", action="store_true", help="ignore progress of the interrupted reindex")
+    parser.add_argument("--prune-archive", action="store_true", help="remove archived audio of deleted samples")
+    sys.exit(asyncio.run(main(parser.parse_args())))
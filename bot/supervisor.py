@@ -0,0 +1,166 @@
+"""Supervised execution of external commands (ffmpeg, fingerprinting backends)."""
+
+import os
+import sys
+import signal
+import asyncio
+import weakref
+
+from loguru import logger
+from contextlib import suppress
+
+from bot.metrics import COMMAND_SECONDS, COMMAND_WAIT_SECONDS, COMMAND_ERRORS, command_name
+
+# Keep only the end of stderr, that is where the error is
+STDERR_TAIL_SIZE = 64 * 1024
+
+_processes_slots = os.cpu_count() or 1
+_processes_semaphore = asyncio.Semaphore(_processes_slots)
+# Commands which need several slots take them one by one, two of them never wait for each other
+_multi_slot_lock = asyncio.Lock()
+_memory_limit = None
+# Task -> name of the command it runs, for profiling
+_running_commands = weakref.WeakKeyDictionary()
+
+
+class CommandError(Exception):
+    def __init__(self, cmd: list, returncode: int, stderr: str):
+        super().__init__(f"{cmd!r} exited with {returncode}\n{stderr}")
+        self.cmd = cmd
+        self.returncode = returncode
+        self.stderr = stderr
+
+
+class CommandTimeout(CommandError):
+    def __init__(self, cmd: list, timeout: float, stderr: str):
+        super().__init__(cmd, None, stderr)
+        self.args = (f"{cmd!r} was killed after {timeout} seconds\n{stderr}",)
+
+
+def configure_supervisor(max_processes: int = None, memory_limit: int = None) -> None:
+    """
+    max_processes - how many commands may run at the same time, other wait for a free slot
+    memory_limit - address space limit of every command in bytes, None - unlimited.
+    Don't use with SoundFingerprinting, .NET reserves a lot of address space at start
+    """
+    global _processes_slots, _processes_semaphore, _memory_limit
+    if max_processes:
+        _processes_slots = max_processes
+        _processes_semaphore = asyncio.Semaphore(max_processes)
+    _memory_limit = memory_limit
+
+
+def process_slots() -> int:
+    """How many processes the commands may run at the same time"""
+    return _processes_slots
+
+
+def task_command(task):
+    """Name of the command the task runs or waits a process slot for, None if it doesn't run commands"""
+    return _running_commands.get(task)
+
+
+# preexec_fn may deadlock the forked child of a process with threads, limits are applied by a wrapper which execs the command
+_LIMITS_WRAPPER = """
+import os, sys, resource
+for limit, value in ((resource.RLIMIT_AS, int(sys.argv[1])), (resource.RLIMIT_CPU, int(sys.argv[2]))):
+    if value:
+        resource.setrlimit(limit, (value, value))
+os.execvp(sys.argv[3], sys.argv[3:])
+"""
+
+
+def _limited_cmd(cmd: list, cpu_time_limit) -> list:
+    if not _memory_limit and not cpu_time_limit:
+        return cmd
+    return [sys.executable, '-c', _LIMITS_WRAPPER, str(_memory_limit or 0), str(cpu_time_limit or 0), *cmd]
+
+
+async def _acquire_slots(count: int) -> None:
+    if count == 1:
+        await _processes_semaphore.acquire()
+        return
+    async with _multi_slot_lock:
+        acquired = 0
+        try:
+            while acquired < count:
+                await _processes_semaphore.acquire()
+                acquired += 1
+        except BaseException:
+            for _ in range(acquired):
+                _processes_semaphore.release()
+            raise
+
+
+async def _read_tail(stream) -> bytes:
+    tail = b""
+    while chunk := await stream.read(STDERR_TAIL_SIZE):
+        tail = (tail + chunk)[-STDERR_TAIL_SIZE:]
+    return tail
+
+
+def _kill(proc) -> None:
+    # The command runs in its own session, kill it with all its children (audfprint -H spawns workers)
+    with suppress(ProcessLookupError):
+        os.killpg(proc.pid, signal.SIGKILL)
+
+
+async def stream_command(cmd: list, timeout: float = None, processes: int = 1):
+    """
+    Runs command and yields lines of its stdout as soon as they arrive.
+
+    The command is killed if it runs longer than `timeout` seconds or if the
+    calling task is cancelled. Raises CommandError if command failed.
+    processes - how many process slots the command takes, audfprint -H N runs N workers
+    """
+    processes = min(max(processes, 1), _processes_slots)
+    cpu_time_limit = int(timeout * (os.cpu_count() or 1)) if timeout else None
+    name = command_name(cmd)
+    loop = asyncio.get_running_loop()
+    task = asyncio.current_task()
+    _running_commands[task] = f"{name} waiting for process slot"
+    waiting_started = loop.time()
+    try:
+        await _acquire_slots(processes)
+    finally:
+        _running_commands.pop(task, None)
+    try:
+        COMMAND_WAIT_SECONDS.observe(loop.time() - waiting_started, command=name)
+        _running_commands[task] = name
+        deadline = loop.time() + timeout if timeout else None
+        started = loop.time()
+        proc = await asyncio.create_subprocess_exec(
+            *_limited_cmd(cmd, cpu_time_limit), stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            start_new_session=True
+        )
+        stderr_tail = asyncio.create_task(_read_tail(proc.stderr))
+        try:
+            while line := await asyncio.wait_for(proc.stdout.readline(), deadline and deadline - loop.time()):
+                yield line.rstrip().decode(errors='replace')
+            await asyncio.wait_for(proc.wait(), deadline and deadline - loop.time())
+        except asyncio.TimeoutError:
+            _kill(proc)
+            await proc.wait()
+            COMMAND_ERRORS.inc(command=name)
+            raise CommandTimeout(cmd, timeout, (await stderr_tail).decode(errors='replace'))
+        finally:
+            if proc.returncode is None:
+                _kill(proc)
+                await proc.wait()
+            COMMAND_SECONDS.observe(loop.time() - started, command=name)
+
+        stderr = (await stderr_tail).decode(errors='replace')
+        logger.debug(f'[{cmd!r} exited with {proc.returncode} in {loop.time() - started:.2f}s]')
+        logger.debug(f'[stderr]\n{stderr}')
+        if proc.returncode != 0:
+            COMMAND_ERRORS.inc(command=name)
+            raise CommandError(cmd, proc.returncode, stderr)
+    finally:
+        _running_commands.pop(task, None)
+        for _ in range(processes):
+            _processes_semaphore.release()
+
+
+async def execute_command(cmd: list, timeout: float = None, processes: int = 1) -> list:
+    """Runs command under supervision of `stream_command`, returns lines of its stdout"""
+    return [line async for line in stream_command(cmd, timeout, processes)]
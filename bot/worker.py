@@ -0,0 +1,36 @@
+"""
+Standalone job worker. Takes jobs from the job table shared with the bot, so
+that fingerprinting capacity can be scaled independently of the bot process.
+Workers run on the same host as the bot, see JobStore.
+Set JOB_WORKERS=0 in the bot process to leave all jobs to the workers.
+Every process serves its own metrics, give each one its own METRICS_PORT.
+
+Usage:
+    python -m bot.worker [number of parallel jobs]
+"""
+
+import sys
+import signal
+import asyncio
+import logging
+
+from bot.__main__ import bot, run_job_workers, job_workers_shutdown, start_diagnostics, stop_diagnostics
+
+
+async def main(count: int):
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, job_workers_shutdown.set)
+
+    logging.warning(f"Starting {count} job workers...")
+    await start_diagnostics()
+    try:
+        await run_job_workers(count)
+    finally:
+        await stop_diagnostics()
+        session = await bot.get_session()
+        await session.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 1))
@@ -0,0 +1,26 @@
+import json
+
+import pytest
+
+ffmpeg_normalize_main = pytest.importorskip("ffmpeg_normalize.__main__")
+
+from bot.audio import preprocessing_cmd, query_trim_filter
+from bot.constants import AudioPreprocessingEnum
+
+
+def test_full_profile_command_is_accepted_by_ffmpeg_normalize():
+    cmd = preprocessing_cmd("query.ogg", "query.mp3", AudioPreprocessingEnum.full.value, query_trim_filter(-45, 30), 60.0)
+    assert cmd[0] == "ffmpeg-normalize"
+
+    args = ffmpeg_normalize_main.create_parser().parse_args(cmd[1:])
+    assert args.input == ["query.ogg"]
+    assert args.output == ["query.mp3"]
+    assert args.pre_filter == query_trim_filter(-45, 30)
+    assert json.loads(args.extra_input_options) == ["-t", "60.0"]
+
+
+def test_full_profile_command_without_limits():
+    cmd = preprocessing_cmd("sample.flac", "sample.mp3", AudioPreprocessingEnum.full.value)
+    args = ffmpeg_normalize_main.create_parser().parse_args(cmd[1:])
+    assert args.extra_input_options is None
+    assert args.pre_filter is None
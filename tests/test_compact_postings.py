@@ -0,0 +1,51 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from benchmarks.compact_postings import Postings, encode_varints, decode_varints
+
+
+def test_varints_round_trip():
+    values = np.array([0, 1, 127, 128, 300, 16383, 16384, 2 ** 32, 2 ** 63, 2 ** 64 - 1], dtype=np.uint64)
+    data = encode_varints(values)
+    assert data.dtype == np.uint8
+    assert np.array_equal(decode_varints(data), values)
+
+
+def test_varints_lengths():
+    assert encode_varints(np.array([127], dtype=np.uint64)).tolist() == [0x7F]
+    assert encode_varints(np.array([128], dtype=np.uint64)).tolist() == [0x80, 0x01]
+    assert len(encode_varints(np.array([2 ** 64 - 1], dtype=np.uint64))) == 10
+
+
+def test_varints_empty():
+    assert len(encode_varints(np.zeros(0, dtype=np.uint64))) == 0
+    assert len(decode_varints(np.zeros(0, dtype=np.uint8))) == 0
+
+
+def test_postings_lookup_matches_brute_force(tmp_path):
+    rng = np.random.default_rng(0)
+    hashes = rng.integers(0, 1000, 5000, dtype=np.uint32)
+    tracks = rng.integers(0, 90, 5000, dtype=np.uint64)
+    times = rng.integers(0, 2 ** 14, 5000, dtype=np.uint64)
+    postings = Postings.from_arrays(hashes, tracks, times, 14)
+    assert postings.postings_count == 5000
+
+    postings_file = tmp_path / "postings.npz"
+    postings.save(postings_file)
+    postings = Postings.load(postings_file)
+
+    query = np.array([hashes[0], 5000, hashes[1], hashes[0]], dtype=np.uint32)
+    found, found_tracks, found_times = postings.lookup(query)
+    expected = sorted(
+        (num, int(track), int(time))
+        for num, query_hash in enumerate(query)
+        for hash_, track, time in zip(hashes, tracks, times) if hash_ == query_hash
+    )
+    assert sorted(zip(found.tolist(), found_tracks.tolist(), found_times.tolist())) == expected
+
+
+def test_postings_lookup_missing_hashes():
+    postings = Postings.from_arrays([1, 2], [0, 1], [5, 6], 14)
+    found, tracks, times = postings.lookup([3, 4])
+    assert len(found) == len(tracks) == len(times) == 0
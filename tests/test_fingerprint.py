@@ -0,0 +1,23 @@
+from bot.constants import AudioLibrariesEnum, AudfprintModeEnum
+from bot.fingerprint import precompute_cmd, hashes_file, add_hashes_cmds, command_processes
+
+AUDFPRINT = AudioLibrariesEnum.audfprint.value
+SOUNDFINGERPRINTING = AudioLibrariesEnum.SoundFingerprinting.value
+
+
+def test_audfprint_indexes_precomputed_hashes():
+    segments = ["processed/sample@0.mp3", "processed/sample@50.mp3"]
+    cmd = precompute_cmd(AUDFPRINT, AudfprintModeEnum.accurate.value, segments, ncores=2)
+    assert cmd[2:6] == ["precompute", "-p", "", *segments[:1]]
+    assert command_processes(cmd) == 2
+
+    hashes_files = [hashes_file(AUDFPRINT, segment) for segment in segments]
+    assert hashes_files == ["processed/sample@0.afpt", "processed/sample@50.afpt"]
+    (add_cmd,) = add_hashes_cmds(AUDFPRINT, AudfprintModeEnum.accurate.value, "missing.fpdb", hashes_files)
+    assert add_cmd[2:] == ["new", "-d", "missing.fpdb", *hashes_files, "-n", "120", "-X", "-F", "0"]
+    assert command_processes(add_cmd) == 1
+
+
+def test_soundfingerprinting_analyzes_audio():
+    assert precompute_cmd(SOUNDFINGERPRINTING, None, ["sample.mp3"]) is None
+    assert hashes_file(SOUNDFINGERPRINTING, "sample.mp3") == "sample.mp3"
@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+from bot.jobs import JobStore
+
+
+@pytest.fixture
+def jobs(tmp_path):
+    jobs = JobStore(tmp_path / "jobs.db", read_only_kinds=("recognize_query",))
+    jobs.init()
+    return jobs
+
+
+def test_writers_of_one_chat_run_one_at_a_time(jobs):
+    first = jobs.enqueue("upload_audio_sample", 1, {})
+    jobs.enqueue("remove_audio_sample", 1, {})
+    other_chat = jobs.enqueue("upload_audio_sample", 2, {})
+
+    assert jobs.lease("worker:0", 60, 3).job_id == first
+    assert jobs.lease("worker:1", 60, 3).job_id == other_chat
+    assert jobs.lease("worker:2", 60, 3) is None
+
+
+def test_matches_run_alongside_writer_of_the_same_chat(jobs):
+    upload = jobs.enqueue("upload_audio_sample", 1, {})
+    jobs.enqueue("bulk_upload_audio_samples", 1, {})
+    first_match = jobs.enqueue("recognize_query", 1, {})
+    second_match = jobs.enqueue("recognize_query", 1, {})
+
+    assert jobs.lease("worker:0", 60, 3).job_id == upload
+    # Second upload waits for the first one, matches of the same folder don't
+    assert jobs.lease("worker:1", 60, 3).job_id == first_match
+    assert jobs.lease("worker:2", 60, 3).job_id == second_match
+    assert jobs.lease("worker:3", 60, 3) is None
+
+
+def test_writer_runs_alongside_matches_of_the_same_chat(jobs):
+    match = jobs.enqueue("recognize_query", 1, {})
+    upload = jobs.enqueue("upload_audio_sample", 1, {})
+
+    assert jobs.lease("worker:0", 60, 3).job_id == match
+    assert jobs.lease("worker:1", 60, 3).job_id == upload
+
+
+def test_expired_lease_resumes_from_saved_stage(jobs, monkeypatch):
+    job_id = jobs.enqueue("upload_audio_sample", 1, {"folder_id": 1})
+    job = jobs.lease("worker:0", 60, 3)
+    job.stage = 3
+    job.payload["segments"] = [["sample@0.mp3", 0]]
+    jobs.checkpoint(job)
+
+    # Lease is still held by the crashed worker
+    assert jobs.lease("worker:1", 60, 3) is None
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + 120)
+    resumed = jobs.lease("worker:1", 60, 3)
+    assert (resumed.job_id, resumed.stage, resumed.attempts) == (job_id, 3, 2)
+    assert resumed.payload == {"folder_id": 1, "segments": [["sample@0.mp3", 0]]}
+
+    # Crashed worker lost the job, it can't save progress or finish it
+    assert not jobs.heartbeat(job, 60)
+    job.stage = 4
+    jobs.checkpoint(job)
+    jobs.finish(job, "failed", "lost")
+    assert jobs.select_job(job_id).stage == 3
+    assert jobs.count_jobs("running") == 1
+
+    jobs.finish(resumed)
+    assert jobs.count_jobs("running") == 0
+    assert jobs.lease("worker:2", 60, 3) is None
+
+
+def test_job_fails_after_too_many_attempts(jobs, monkeypatch):
+    jobs.enqueue("upload_audio_sample", 1, {})
+    now = time.time()
+    for attempt in range(3):
+        monkeypatch.setattr(time, "time", lambda: now + attempt * 120)
+        assert jobs.lease(f"worker:{attempt}", 60, 3).attempts == attempt + 1
+
+    monkeypatch.setattr(time, "time", lambda: now + 3 * 120)
+    assert jobs.lease("worker:3", 60, 3) is None
+    assert jobs.count_jobs("failed") == 1
+
+
+def test_released_job_is_leased_again(jobs):
+    job_id = jobs.enqueue("upload_audio_sample", 1, {})
+    jobs.lease("worker:0", 60, 3)
+    jobs.release("worker:0")
+
+    job = jobs.lease("worker:1", 60, 3)
+    assert (job.job_id, job.attempts) == (job_id, 1)
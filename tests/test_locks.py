@@ -0,0 +1,79 @@
+import asyncio
+
+from bot.locks import FolderLock, file_version
+
+
+def test_matches_overlap_while_writer_publishes(tmp_path):
+    fingerprint_db = tmp_path / "folder.fpdb"
+    fingerprint_db.write_text("v1")
+    lock = FolderLock(str(fingerprint_db))
+
+    async def main():
+        readers_started = asyncio.Event()
+        published = asyncio.Event()
+        readers = 0
+
+        async def match():
+            nonlocal readers
+            async with lock.read() as snapshot:
+                # Backend loads the database when the match starts
+                with open(snapshot) as database:
+                    readers += 1
+                    if readers == 2:
+                        readers_started.set()
+                    await published.wait()
+                    return database.read()
+
+        async def upload():
+            await readers_started.wait()
+            async with lock.write() as working_copy:
+                # Writer doesn't wait for the running matches
+                assert lock.readers == 2
+                with open(working_copy) as database:
+                    assert database.read() == "v1"
+                with open(working_copy, "w") as database:
+                    database.write("v2")
+                version = file_version(working_copy)
+            assert file_version(fingerprint_db) == version
+            published.set()
+
+        results = await asyncio.wait_for(asyncio.gather(match(), match(), upload()), 5)
+        assert results[:2] == ["v1", "v1"]
+        async with lock.read() as snapshot:
+            with open(snapshot) as database:
+                assert database.read() == "v2"
+
+    asyncio.run(main())
+
+
+def test_failed_writer_publishes_nothing(tmp_path):
+    fingerprint_db = tmp_path / "folder.fpdb"
+    fingerprint_db.write_text("v1")
+    lock = FolderLock(str(fingerprint_db))
+
+    async def main():
+        try:
+            async with lock.write() as working_copy:
+                with open(working_copy, "w") as database:
+                    database.write("v2")
+                raise RuntimeError("fingerprinting failed")
+        except RuntimeError:
+            pass
+        assert fingerprint_db.read_text() == "v1"
+        assert not (tmp_path / "folder.fpdb.tmp").exists()
+
+    asyncio.run(main())
+
+
+def test_removed_working_copy_removes_database(tmp_path):
+    fingerprint_db = tmp_path / "folder.fpdb"
+    fingerprint_db.write_text("v1")
+    lock = FolderLock(str(fingerprint_db))
+
+    async def main():
+        async with lock.write() as working_copy:
+            (tmp_path / working_copy).unlink()
+        assert not fingerprint_db.exists()
+        assert file_version(fingerprint_db) is None
+
+    asyncio.run(main())
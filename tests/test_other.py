@@ -0,0 +1,49 @@
+import zipfile
+
+import pytest
+
+from bot.other import extract_audio_files
+
+
+def make_archive(path, files: dict):
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, data in files.items():
+            archive.writestr(name, data)
+    return str(path)
+
+
+def test_extracts_audio_files_into_flat_directory(tmp_path):
+    archive = make_archive(tmp_path / "samples.zip", {
+        "first.mp3": b"1" * 10,
+        "nested/second.WAV": b"2" * 10,
+        "nested/first.mp3": b"duplicate name",
+        "notes.txt": b"not audio",
+        "__MACOSX/._first.mp3": b"resource fork",
+    })
+    destination = tmp_path / "out"
+    destination.mkdir()
+
+    extracted = extract_audio_files(archive, str(destination), 100, 1000, 10)
+    assert sorted(extracted) == [str(destination / "first.mp3"), str(destination / "second.WAV")]
+    assert (destination / "first.mp3").read_bytes() == b"1" * 10
+
+
+def test_skips_large_files_and_limits_count(tmp_path):
+    archive = make_archive(tmp_path / "samples.zip", {
+        "large.mp3": b"0" * 101,
+        "a.mp3": b"a",
+        "b.mp3": b"b",
+        "c.mp3": b"c",
+    })
+    extracted = extract_audio_files(archive, str(tmp_path), 100, 1000, 2)
+    assert [path.rsplit("/", 1)[1] for path in extracted] == ["a.mp3", "b.mp3"]
+
+
+def test_rejects_archive_larger_than_total_limit(tmp_path):
+    archive = make_archive(tmp_path / "samples.zip", {f"{num}.mp3": b"0" * 60 for num in range(3)})
+    destination = tmp_path / "out"
+    destination.mkdir()
+
+    with pytest.raises(ValueError):
+        extract_audio_files(archive, str(destination), 100, 150, 10)
+    assert not list(destination.iterdir())
@@ -0,0 +1,35 @@
+import asyncio
+import os
+
+from bot import profiling
+from bot.jobs import Job
+
+
+def test_restarted_profiler_keeps_sessions_apart(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILES_PATH", str(tmp_path))
+    profiler = profiling.JobProfiler()
+
+    async def job():
+        started = asyncio.get_running_loop().time()
+        while asyncio.get_running_loop().time() - started < 0.05:
+            await asyncio.sleep(0)
+
+    async def main():
+        first_session = profiler.start(1)
+        with profiler.profile_job(Job(1, "recognize_query", 1, 0, {}, 1, "worker", 0)):
+            await job()
+        while profiler._session is not None:
+            await asyncio.sleep(0.001)
+        # Sampler of the first session may still be writing its profile
+        second_session = profiler.start(1)
+        with profiler.profile_job(Job(2, "recognize_query", 1, 0, {}, 1, "worker", 0)):
+            await job()
+        while profiler._session is not None:
+            await asyncio.sleep(0.01)
+        return first_session, second_session
+
+    first_session, second_session = asyncio.run(main())
+    assert first_session != second_session
+    assert "job_1_recognize_query.collapsed" in os.listdir(first_session)
+    assert "job_2_recognize_query.collapsed" in os.listdir(second_session)
+    assert "job_2_recognize_query.collapsed" not in os.listdir(first_session)
@@ -0,0 +1,54 @@
+import os
+import sys
+import asyncio
+
+import pytest
+
+from bot import supervisor
+
+
+@pytest.fixture
+def slots(monkeypatch):
+    monkeypatch.setattr(supervisor, "_memory_limit", None)
+    monkeypatch.setattr(supervisor, "_processes_slots", 2)
+    monkeypatch.setattr(supervisor, "_processes_semaphore", asyncio.Semaphore(2))
+    monkeypatch.setattr(supervisor, "_multi_slot_lock", asyncio.Lock())
+
+
+def test_limits_are_applied_by_exec_wrapper(slots, monkeypatch):
+    monkeypatch.setattr(supervisor, "_memory_limit", 2 ** 34)
+    cmd = [sys.executable, "-c", "import resource; print(*resource.getrlimit(resource.RLIMIT_AS), *resource.getrlimit(resource.RLIMIT_CPU))"]
+    lines = asyncio.run(supervisor.execute_command(cmd, timeout=10))
+    cpu_time_limit = int(10 * (os.cpu_count() or 1))
+    assert lines == [f"{2 ** 34} {2 ** 34} {cpu_time_limit} {cpu_time_limit}"]
+
+
+def test_command_without_limits_runs_directly(slots):
+    cmd = [sys.executable, "-c", "print('ok')"]
+    assert supervisor._limited_cmd(cmd, None) == cmd
+    assert asyncio.run(supervisor.execute_command(cmd)) == ["ok"]
+
+
+def test_command_failure(slots):
+    with pytest.raises(supervisor.CommandError) as error:
+        asyncio.run(supervisor.execute_command([sys.executable, "-c", "import sys; sys.exit('broken')"], timeout=10))
+    assert error.value.returncode == 1
+    assert "broken" in error.value.stderr
+
+
+def test_command_with_workers_takes_several_slots(slots):
+    sleep = [sys.executable, "-c", "import time; time.sleep(0.3)"]
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        workers = asyncio.create_task(supervisor.execute_command(sleep, processes=5))
+        await asyncio.sleep(0.05)
+        # All slots are taken by the command with workers, the number of workers is capped by the slots
+        assert supervisor._processes_semaphore.locked()
+        await supervisor.execute_command([sys.executable, "-c", "pass"])
+        assert loop.time() - started >= 0.3
+        await workers
+        assert not supervisor._processes_semaphore.locked()
+
+    asyncio.run(main())